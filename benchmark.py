@@ -0,0 +1,379 @@
+import sys
+import time
+import itertools
+import argparse
+from typing import Callable
+
+import numpy as np
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "2160p": (3840, 2160),
+}
+
+# Real photographs bundled with scikit-image, on which the fast BRISQUE path is checked, at their
+# own size (chelsea and rocket have an odd side) and resized to sizes with odd sides (which aren't
+# downscaled by exactly two), such as a 2.40:1 scope frame resized to the BRISQUE width of 1280
+BRISQUE_CHECK_IMAGES = ["astronaut", "camera", "chelsea", "coffee", "rocket"]
+BRISQUE_CHECK_SIZES = [None, (1280, 533), (451, 301)]
+# Maximum absolute difference of the (scaled) features computed at full size, of the ones computed
+# on the downscaled image, and of the score. The features aren't bit-identical: OpenCV's separable
+# filter sums in a different order (which depends on the build), and the root finding of the
+# distribution fits amplifies such rounding differences to about 1e-4 with versions of NumPy,
+# SciPy and OpenCV other than the pinned ones. That's still far from moving the score noticeably.
+BRISQUE_FULL_SIZE_TOLERANCE = 1e-3
+BRISQUE_DOWNSCALED_TOLERANCE = 1e-3
+BRISQUE_SCORE_TOLERANCE = 0.5
+
+def synthetic_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    # Blurred noise, so there's a realistic amount of edges (grayscale, uint8)
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    noise = (rng.random((height, width)) * 255).astype(np.uint8)
+    return cv2.GaussianBlur(noise, (5, 5), 2)
+
+
+def timed(func: Callable, repeats: int) -> tuple[float, object]:
+    # Returns the best wall time out of all repeats
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t_start)
+    return best, result
+
+
+def reference_sharpness_matrix(dom, Im, width=2):
+    # The original (per-row/per-column Python loop) implementation of DOM.sharpness_matrix
+    domx, domy = dom.dom(Im)
+    Cx, Cy = dom.contrast(Im)
+    Cx = np.multiply(Cx, dom.edgex)
+    Cy = np.multiply(Cy, dom.edgey)
+
+    Sx = np.zeros(domx.shape)
+    Sy = np.zeros(domy.shape)
+
+    for i in range(width, domx.shape[0] - width):
+        num = np.abs(domx[i - width:i + width, :]).sum(axis=0)
+        dn = Cx[i - width:i + width, :].sum(axis=0)
+        Sx[i] = [(num[k] / dn[k] if dn[k] > 1e-3 else 0) for k in range(Sx.shape[1])]
+
+    for j in range(width, domy.shape[1] - width):
+        num = np.abs(domy[:, j - width: j + width]).sum(axis=1)
+        dn = Cy[:, j - width:j + width].sum(axis=1)
+        Sy[:, j] = [(num[k] / dn[k] if dn[k] > 1e-3 else 0) for k in range(Sy.shape[0])]
+
+    return Sx, Sy
+
+
+def reference_smoothen_image(image, transpose=False, epsilon=1e-8):
+    # The original (per-row np.convolve) implementation of DOM.smoothenImage
+    fil = np.array([0.5, 0, -0.5])
+    if transpose:
+        image = image.T
+
+    image_smoothed = np.array([np.convolve(image[i], fil, mode="same") for i in range(image.shape[0])])
+    if transpose:
+        image_smoothed = image_smoothed.T
+
+    return np.abs(image_smoothed) / (np.max(image_smoothed) + epsilon)
+
+
+def reference_edges(image, edge_threshold=0.0001):
+    smoothx = reference_smoothen_image(image, transpose=True)
+    smoothy = reference_smoothen_image(image)
+    return smoothx > edge_threshold, smoothy > edge_threshold
+
+
+def benchmark_edges(repeats: int) -> None:
+    from sharpness import DOM
+
+    print("DOM.edges (reference per-row convolutions vs. whole-image correlation)")
+    for name, (width, height) in RESOLUTIONS.items():
+        dom = DOM()
+        image = synthetic_frame(width, height)
+
+        def edges():
+            dom.edges(image)
+            return dom.edgex, dom.edgey
+
+        t_reference, (ref_x, ref_y) = timed(lambda: reference_edges(image), repeats)
+        t_vectorized, (edgex, edgey) = timed(edges, repeats)
+
+        identical = np.array_equal(ref_x, edgex) and np.array_equal(ref_y, edgey)
+        print(
+            f"{' ':2}{name}: {t_reference:.3f}s -> {t_vectorized:.3f}s "
+            f"({t_reference / t_vectorized:.1f}x faster, identical edge masks: {identical})"
+        )
+
+
+def benchmark_sharpness(repeats: int) -> None:
+    from sharpness import DOM
+
+    print("DOM.sharpness_matrix (reference loops vs. vectorized)")
+    for name, (width, height) in RESOLUTIONS.items():
+        dom = DOM()
+        image, Im = dom.load(synthetic_frame(width, height))
+        dom.edges(image)
+
+        t_reference, (ref_x, ref_y) = timed(lambda: reference_sharpness_matrix(dom, Im), repeats)
+        t_vectorized, (sx, sy) = timed(lambda: dom.sharpness_matrix(Im), repeats)
+
+        max_diff = max(np.abs(ref_x - sx).max(), np.abs(ref_y - sy).max())
+        print(
+            f"{' ':2}{name}: {t_reference:.3f}s -> {t_vectorized:.3f}s "
+            f"({t_reference / t_vectorized:.1f}x faster, max. abs. difference {max_diff:.2e})"
+        )
+
+
+def benchmark_brisque(repeats: int) -> None:
+    import cv2
+    import brisque
+    from scoring_context import resize_to_width
+
+    print("brisque features (reference vs. fast path, on 1280px wide RGB frames)")
+    for name, (width, height) in RESOLUTIONS.items():
+        image = resize_to_width(cv2.cvtColor(synthetic_frame(width, height), cv2.COLOR_GRAY2RGB), 1280)
+
+        t_reference, reference = timed(lambda: brisque.calculate_features(image, 7, 7 / 6), repeats)
+        t_fast, fast = timed(lambda: brisque.calculate_features_fast(image, 7, 7 / 6), repeats)
+
+        # The first half of the features is computed at full size, the second half downscaled
+        n = len(reference) // 2
+        print(
+            f"{' ':2}{name}: {t_reference:.3f}s -> {t_fast:.3f}s ({t_reference / t_fast:.1f}x faster)\n"
+            f"{' ':4}max. abs. feature difference: {np.abs(reference[:n] - fast[:n]).max():.2e} (full size), "
+            f"{np.abs(reference[n:] - fast[n:]).max():.2e} (downscaled)\n"
+            f"{' ':4}score: {brisque.predict(reference):.2f} -> {brisque.predict(fast):.2f}"
+        )
+
+
+def check_brisque(repeats: int) -> bool:
+    # Fails if the fast path drifts from the reference implementation
+    import brisque
+    from PIL import Image
+    from skimage import data
+
+    print(
+        f"brisque regression check (fast path vs. reference, tolerances: {BRISQUE_FULL_SIZE_TOLERANCE:g} "
+        f"full size, {BRISQUE_DOWNSCALED_TOLERANCE:g} downscaled, {BRISQUE_SCORE_TOLERANCE:g} score)"
+    )
+    passed = True
+    for name, size in itertools.product(BRISQUE_CHECK_IMAGES, BRISQUE_CHECK_SIZES):
+        image = getattr(data, name)()
+        if image.ndim == 2:
+            image = np.stack([image] * 3, axis=-1)
+        if size is not None:
+            image = np.asarray(Image.fromarray(image).resize(size, Image.Resampling.LANCZOS))
+
+        reference = brisque.calculate_features(image, 7, 7 / 6)
+        fast = brisque.calculate_features_fast(image, 7, 7 / 6)
+
+        n = len(reference) // 2
+        differences = {
+            "full size": (np.abs(reference[:n] - fast[:n]).max(), BRISQUE_FULL_SIZE_TOLERANCE),
+            "downscaled": (np.abs(reference[n:] - fast[n:]).max(), BRISQUE_DOWNSCALED_TOLERANCE),
+            "score": (abs(brisque.predict(reference) - brisque.predict(fast)), BRISQUE_SCORE_TOLERANCE),
+        }
+        failed = [k for k, (difference, tolerance) in differences.items() if difference > tolerance]
+        passed = passed and not failed
+
+        print(
+            f"{' ':2}{name} ({image.shape[1]}x{image.shape[0]}): {'FAILED' if failed else 'ok'} ("
+            + ", ".join(f"{k} {difference:.2e}" for k, (difference, _) in differences.items())
+            + ")"
+        )
+    return passed
+
+
+def benchmark_svm(repeats: int) -> None:
+    import brisque
+
+    print("brisque SVR prediction (one libsvm call per image vs. one batched evaluation)")
+    rng = np.random.default_rng(0)
+    for n_images in (10, 100, 1000):
+        features = rng.uniform(brisque._scale_min, brisque._scale_max, (n_images, len(brisque._scale_min)))
+
+        t_reference, reference = timed(
+            lambda: np.array([brisque.predict(brisque.scale_features(f)) for f in features]), repeats
+        )
+        t_batched, batched = timed(lambda: brisque.score_batch(features), repeats)
+
+        print(
+            f"{' ':2}{n_images} images: {t_reference:.4f}s -> {t_batched:.4f}s "
+            f"({t_reference / t_batched:.1f}x faster, max. abs. difference {np.abs(reference - batched).max():.2e})"
+        )
+
+
+def _peak_rss_mb() -> float:
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure_worker_rss(width: int, height: int, compact: bool, brisque_fast: bool) -> tuple[float, float]:
+    # Runs in a fresh process: peak RSS after loading everything and after scoring one frame
+    import cv2
+    from config import Config
+    from pathlib import Path
+    from screenshot_processor import ScreenshotMetadata, analyze_screenshot
+
+    Config.screenshots_sharpness_compact = compact
+    Config.screenshots_brisque_fast = brisque_fast
+
+    frame = cv2.cvtColor(synthetic_frame(width, height), cv2.COLOR_GRAY2RGB)
+    screenshot = ScreenshotMetadata(path=Path("benchmark.png"), file_size=1, max_file_size=1, frame=frame)
+
+    import brisque  # noqa: F401 (loads the model)
+    baseline = _peak_rss_mb()
+    analyze_screenshot(screenshot)
+    return baseline, _peak_rss_mb()
+
+
+def benchmark_memory(repeats: int) -> None:
+    import multiprocessing
+
+    # Every measurement needs a fresh process, as the peak RSS can't be reset
+    context = multiprocessing.get_context("spawn")
+
+    print("peak RSS of a scoring worker (loaded modules + frame -> after scoring one frame)")
+    for name, (width, height) in RESOLUTIONS.items():
+        for compact, brisque_fast in ((False, False), (True, False), (True, True)):
+            with context.Pool(1) as pool:
+                baseline, peak = pool.apply(_measure_worker_rss, (width, height, compact, brisque_fast))
+
+            print(
+                f"{' ':2}{name} (compact sharpness: {compact}, fast BRISQUE: {brisque_fast}): "
+                f"{baseline:.0f}MB -> {peak:.0f}MB (+{peak - baseline:.0f}MB)"
+            )
+
+
+def benchmark_executor(repeats: int) -> None:
+    import io
+    import cv2
+    import contextlib
+    from config import Config
+    from pathlib import Path
+    import importlib
+    from screenshot_processor import (
+        SCORING_EXECUTORS, ScreenshotMetadata, WorkerPool, analyze_screenshot
+    )
+    from scorers import worker_modules
+
+    # Threads (and the serial executor) load the modules only once per run, processes once per worker
+    t_start = time.perf_counter()
+    for module in worker_modules():
+        importlib.import_module(module)
+    t_modules = time.perf_counter() - t_start
+
+    width, height = RESOLUTIONS["1080p"]
+    print(
+        f"scoring executors (start-up + scoring of raw 1080p frames, {Config.screenshots_scoring_processes or 'auto'} "
+        f"workers, plus {t_modules:.2f}s for loading the modules once for thread and serial)"
+    )
+    for n_screenshots in (1, 4, 16):
+        screenshots = [
+            ScreenshotMetadata(
+                path=Path(f"benchmark_{i}.png"),
+                file_size=1,
+                max_file_size=1,
+                frame=cv2.cvtColor(synthetic_frame(width, height, seed=i), cv2.COLOR_GRAY2RGB),
+            )
+            for i in range(n_screenshots)
+        ]
+
+        def score():
+            # Time a whole run, i.e. including starting (and stopping) the pool
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return WorkerPool.get(n_screenshots, (width, height)).map(analyze_screenshot, screenshots)
+            finally:
+                WorkerPool.shutdown()
+
+        times = {}
+        for executor in SCORING_EXECUTORS:
+            Config.screenshots_scoring_executor = executor
+            times[executor], _ = timed(score, repeats)
+
+        print(f"{' ':2}{n_screenshots} screenshots: " + ", ".join(f"{k} {v:.2f}s" for k, v in times.items()))
+
+
+def benchmark_scorers(repeats: int) -> None:
+    import cv2
+    import scorers
+    from config import Config
+    from pathlib import Path
+    from scoring_context import ScoringContext
+    from screenshot_processor import brisque_features_of, sharpness_score_of
+
+    # The metrics the scoring pipeline computes itself
+    builtin = {
+        "brisque": brisque_features_of,
+        "sharpness": sharpness_score_of,
+    }
+
+    print("screenshot metrics (CPU time per raw frame, including the views they need)")
+    for name, (width, height) in RESOLUTIONS.items():
+        frame = cv2.cvtColor(synthetic_frame(width, height), cv2.COLOR_GRAY2RGB)
+
+        times = {}
+        for metric in scorers.METRICS.values():
+            compute = metric.compute or builtin.get(metric.name)
+            if compute is None:
+                continue
+
+            def run():
+                # A new context, so the views are derived again every time
+                context = ScoringContext(
+                    Path("benchmark.png"),
+                    frame=frame,
+                    brisque_max_width=Config.screenshots_brisque_max_width,
+                    sharpness_max_width=Config.screenshots_sharpness_max_width,
+                )
+                return compute(context)
+
+            times[metric.name], _ = timed(run, repeats)
+
+        print(f"{' ':2}{name}: " + ", ".join(f"{k} {v * 1000:.1f}ms" for k, v in times.items()))
+
+
+BENCHMARKS = {
+    "sharpness": benchmark_sharpness,
+    "edges": benchmark_edges,
+    "brisque": benchmark_brisque,
+    "brisque_check": check_brisque,
+    "svm": benchmark_svm,
+    "memory": benchmark_memory,
+    "executor": benchmark_executor,
+    "scorers": benchmark_scorers,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        metavar="N",
+        help="Number of times to run each measurement (the best time is reported)",
+    )
+    parser.add_argument(
+        "benchmark",
+        nargs="*",
+        help=f"Benchmarks to run (all of them by default): {', '.join(BENCHMARKS.keys())}",
+    )
+
+    args = parser.parse_args()
+    for benchmark in args.benchmark:
+        if benchmark not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {benchmark}")
+
+    # Checks return False if they fail
+    failed = [
+        benchmark for benchmark in args.benchmark or BENCHMARKS.keys() if BENCHMARKS[benchmark](args.repeats) is False
+    ]
+    if failed:
+        print(f"failed: {', '.join(failed)}")
+        sys.exit(1)
@@ -18,16 +18,19 @@ import pickle
 import typing
 import warnings
 from enum import Enum
+from functools import cached_property
 
 import PIL.Image
+import cv2
 import numpy
+import scipy.ndimage
 import scipy.signal
 import skimage.color
 import skimage.transform
 from libsvm import svmutil
 
 from imquality.models import MODELS_PATH
-from imquality.statistics import AsymmetricGeneralizedGaussian, gaussian_kernel2d
+from imquality.statistics import AsymmetricGeneralizedGaussian, DistributionSide, gaussian_kernel2d
 from imquality.utils import pil2ndarray
 
 with open(os.path.join(MODELS_PATH, "normalize.pickle"), "rb") as file:
@@ -35,6 +38,37 @@ with open(os.path.join(MODELS_PATH, "normalize.pickle"), "rb") as file:
 
 model = svmutil.svm_load_model(os.path.join(MODELS_PATH, "brisque_svm.txt"))
 
+# Parsed once, instead of on every scale_features/predict call
+_scale_min = numpy.array(scale_parameters["min_"])
+_scale_max = numpy.array(scale_parameters["max_"])
+# Padding scipy.ndimage applies before prefiltering for a spline interpolation (mode="grid-constant")
+SPLINE_PAD = 12
+
+
+def _dense_support_vectors(m) -> numpy.ndarray:
+    # libsvm stores support vectors sparsely (1-based indices, zeros omitted)
+    rows = m.get_SV()
+    n_features = max((max(row, default=0) for row in rows), default=0)
+    support_vectors = numpy.zeros((len(rows), max(n_features, len(_scale_min))))
+    for i, row in enumerate(rows):
+        for index, value in row.items():
+            if index > 0:
+                support_vectors[i, index - 1] = value
+    return support_vectors
+
+
+# The model is an epsilon-SVR with an RBF kernel, which can be evaluated
+# for many feature vectors at once without going through libsvm
+# (svm_type/kernel_type values from libsvm's svm.h)
+EPSILON_SVR, RBF = 3, 2
+_batch_predict_supported = model.param.svm_type == EPSILON_SVR and model.param.kernel_type == RBF
+if _batch_predict_supported:
+    _support_vectors = _dense_support_vectors(model)
+    _support_vector_norms = numpy.einsum("ij,ij->i", _support_vectors, _support_vectors)
+    _dual_coefficients = numpy.array([c[0] for c in model.get_sv_coef()])
+    _rho = model.rho[0]
+    _gamma = model.param.gamma
+
 
 class MscnType(Enum):
     mscn = 1
@@ -45,6 +79,8 @@ class MscnType(Enum):
 
 
 class Brisque:
+    distribution = AsymmetricGeneralizedGaussian
+
     _local_mean = None
     _local_deviation = None
     _mscn = None
@@ -120,7 +156,7 @@ class Brisque:
         return coefficients[mscn_type]
 
     def calculate_features(self, mscn_type: MscnType):
-        agg = AsymmetricGeneralizedGaussian(self.get_coefficients(mscn_type)).fit()
+        agg = self.distribution(self.get_coefficients(mscn_type)).fit()
         if mscn_type == MscnType.mscn:
             var = numpy.mean(
                 [numpy.square(agg.sigma_left), numpy.square(agg.sigma_right)]
@@ -137,13 +173,127 @@ class Brisque:
         )
 
 
+class CachedAsymmetricGeneralizedGaussian(AsymmetricGeneralizedGaussian):
+    # AsymmetricGeneralizedGaussian recomputes these statistics (over the whole
+    # array) in every iteration of the root finding, even though x never changes.
+    @cached_property
+    def sigma_left(self):
+        return self._sigma(DistributionSide.left)
+
+    @cached_property
+    def sigma_right(self):
+        return self._sigma(DistributionSide.right)
+
+    @cached_property
+    def r_hat(self):
+        return numpy.abs(self.x).mean() ** 2 / self.mean_squares(self.x)
+
+    @cached_property
+    def R_hat(self):
+        return super().R_hat
+
+
+class FastBrisque(Brisque):
+    # Computes (within a tolerance) the same features as Brisque, but
+    #  - the gaussian filter is applied separably (it's an outer product of two 1D kernels)
+    #  - MSCN coefficients are computed in place
+    #  - only the requested pairwise MSCN product is computed (into a reused buffer)
+    #  - the AGGD statistics are computed once per fit
+    distribution = CachedAsymmetricGeneralizedGaussian
+
+    def __init__(
+        self,
+        image: typing.Union[PIL.Image.Image, numpy.ndarray],
+        kernel_size: int = 7,
+        sigma: float = 7 / 6,
+    ):
+        super().__init__(image, kernel_size=kernel_size, sigma=sigma)
+        self.image = numpy.asarray(self.image, dtype=numpy.float64)
+
+        kernel = numpy.exp(-(numpy.arange(kernel_size) - int(kernel_size / 2)) ** 2 / (2 * sigma ** 2))
+        self.kernel1d = kernel / numpy.sum(kernel)
+        self._product = None
+
+    def _filter(self, image: numpy.ndarray) -> numpy.ndarray:
+        # Same as scipy.signal.convolve2d(image, self.kernel, "same") (the kernel is symmetric)
+        return cv2.sepFilter2D(
+            image, cv2.CV_64F, self.kernel1d, self.kernel1d, borderType=cv2.BORDER_CONSTANT
+        )
+
+    @property
+    def local_mean(self):
+        if self._local_mean is None:
+            self._local_mean = self._filter(self.image)
+        return self._local_mean
+
+    @property
+    def local_deviation(self):
+        if self._local_deviation is None:
+            sigma = self._filter(numpy.square(self.image))
+            sigma -= numpy.square(self.local_mean)
+            numpy.abs(sigma, out=sigma)
+            self._local_deviation = numpy.sqrt(sigma, out=sigma)
+        return self._local_deviation
+
+    @property
+    def mscn(self):
+        if self._mscn is None:
+            c = 1 / 255
+            mscn = numpy.subtract(self.image, self.local_mean)
+            mscn /= self.local_deviation + c
+            self._mscn = mscn
+        return self._mscn
+
+    def get_coefficients(self, mscn_type: MscnType):
+        mscn = self.mscn
+        if mscn_type == MscnType.mscn:
+            return mscn
+
+        if self._product is None:
+            self._product = numpy.empty_like(mscn)
+
+        h, w = mscn.shape
+        if mscn_type == MscnType.horizontal:
+            return numpy.multiply(mscn[:, :-1], mscn[:, 1:], out=self._product[:h, :w - 1])
+        elif mscn_type == MscnType.vertical:
+            return numpy.multiply(mscn[:-1, :], mscn[1:, :], out=self._product[:h - 1, :w])
+        elif mscn_type == MscnType.main_diagonal:
+            return numpy.multiply(mscn[:-1, :-1], mscn[1:, 1:], out=self._product[:h - 1, :w - 1])
+        return numpy.multiply(mscn[1:, :-1], mscn[:-1, 1:], out=self._product[:h - 1, :w - 1])
+
+
+def downscale_by_two(image: numpy.ndarray) -> numpy.ndarray:
+    # Same as the bi-quadratic rescale of calculate_features, which (in scikit-image >= 0.19) is
+    # scipy.ndimage.zoom of the zero padded image (mode="grid-constant") to round(shape / 2),
+    # clipped to the range of the image. If both sides are even, the quadratic B-spline is
+    # sampled halfway between two pixels, weighing both by 1/2, so it's the mean of every
+    # 2x2 block of the prefiltered image (which is a lot faster than zoom).
+    shape = tuple(max(1, round(n / 2)) for n in image.shape)
+    if all(2 * m == n for m, n in zip(shape, image.shape)):
+        # Prefiltered like zoom does: padded, so the spline coefficients near the borders are the same
+        padded = numpy.pad(image, SPLINE_PAD, mode="constant")
+        prefiltered = scipy.ndimage.spline_filter(padded, order=2, mode="grid-constant")
+        prefiltered = prefiltered[SPLINE_PAD:-SPLINE_PAD, SPLINE_PAD:-SPLINE_PAD]
+        downscaled = cv2.resize(prefiltered, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+    else:
+        # Odd sides aren't halved exactly (e.g. 533 -> 266), so the samples aren't halfway between two pixels
+        zoom = [1 / (n / m) for m, n in zip(shape, image.shape)]
+        downscaled = scipy.ndimage.zoom(image, zoom, order=2, mode="grid-constant", cval=0, grid_mode=True)
+    return numpy.clip(downscaled, image.min(), image.max(), out=downscaled)
+
+
 def scale_features(features: numpy.ndarray) -> numpy.ndarray:
-    _min = numpy.array(scale_parameters["min_"])
-    _max = numpy.array(scale_parameters["max_"])
-    return -1 + (2.0 / (_max - _min) * (features - _min))
+    # Works on a single feature vector as well as on a (n_images, n_features) matrix
+    return -1 + (2.0 / (_scale_max - _scale_min) * (features - _scale_min))
 
 
-def calculate_features(image: PIL.Image, kernel_size, sigma) -> numpy.ndarray:
+def calculate_features(image: typing.Union[PIL.Image.Image, numpy.ndarray], kernel_size, sigma) -> numpy.ndarray:
+    return scale_features(calculate_unscaled_features(image, kernel_size, sigma))
+
+
+def calculate_unscaled_features(
+    image: typing.Union[PIL.Image.Image, numpy.ndarray], kernel_size, sigma
+) -> numpy.ndarray:
     brisque = Brisque(image, kernel_size=kernel_size, sigma=sigma)
     # WARNING: The algorithm is very sensitive to rescale
     # FIXME: this is empirically the best configuration; however, scikit-image warns about bi-quadratic implementation.
@@ -159,9 +309,24 @@ def calculate_features(image: PIL.Image, kernel_size, sigma) -> numpy.ndarray:
             multichannel=False,
         )
     downscaled_brisque = Brisque(downscaled_image, kernel_size=kernel_size, sigma=sigma)
-    features = numpy.concatenate([brisque.features, downscaled_brisque.features])
-    scaled_features = scale_features(features)
-    return scaled_features
+    return numpy.concatenate([brisque.features, downscaled_brisque.features])
+
+
+def calculate_features_fast(
+    image: typing.Union[PIL.Image.Image, numpy.ndarray], kernel_size, sigma
+) -> numpy.ndarray:
+    return scale_features(calculate_unscaled_features_fast(image, kernel_size, sigma))
+
+
+def calculate_unscaled_features_fast(
+    image: typing.Union[PIL.Image.Image, numpy.ndarray], kernel_size, sigma
+) -> numpy.ndarray:
+    brisque = FastBrisque(image, kernel_size=kernel_size, sigma=sigma)
+    features = brisque.features
+    downscaled_brisque = FastBrisque(
+        downscale_by_two(brisque.image), kernel_size=kernel_size, sigma=sigma
+    )
+    return numpy.concatenate([features, downscaled_brisque.features])
 
 
 def predict(features: numpy.ndarray) -> float:
@@ -173,6 +338,37 @@ def predict(features: numpy.ndarray) -> float:
     return svmutil.libsvm.svm_predict_probability(model, x, prob_estimates)
 
 
-def score(image: PIL.Image.Image, kernel_size=7, sigma=7 / 6) -> float:
-    scaled_features = calculate_features(image, kernel_size, sigma)
-    return predict(scaled_features)
+def predict_batch(features: numpy.ndarray) -> numpy.ndarray:
+    # Same as [predict(f) for f in features], for a (n_images, n_features) matrix of scaled features
+    features = numpy.atleast_2d(features)
+    if not _batch_predict_supported:
+        return numpy.array([predict(f) for f in features])
+
+    # ||x - sv||^2 = ||x||^2 + ||sv||^2 - 2 * x.sv
+    distances = features @ _support_vectors[:, :features.shape[1]].T
+    distances *= -2.0
+    distances += numpy.einsum("ij,ij->i", features, features)[:, numpy.newaxis]
+    distances += _support_vector_norms
+    numpy.maximum(distances, 0.0, out=distances)
+
+    kernel = numpy.exp(-_gamma * distances, out=distances)
+    return kernel @ _dual_coefficients - _rho
+
+
+def unscaled_features(
+    image: typing.Union[PIL.Image.Image, numpy.ndarray], kernel_size=7, sigma=7 / 6, fast=False
+) -> numpy.ndarray:
+    if fast:
+        return calculate_unscaled_features_fast(image, kernel_size, sigma)
+    return calculate_unscaled_features(image, kernel_size, sigma)
+
+
+def score_batch(features: numpy.ndarray) -> numpy.ndarray:
+    # Scores a (n_images, n_features) matrix of unscaled features (see unscaled_features)
+    return predict_batch(scale_features(numpy.atleast_2d(features)))
+
+
+def score(
+    image: typing.Union[PIL.Image.Image, numpy.ndarray], kernel_size=7, sigma=7 / 6, fast=False
+) -> float:
+    return predict(scale_features(unscaled_features(image, kernel_size, sigma, fast=fast)))
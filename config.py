@@ -62,6 +62,85 @@ class Config:
     # See screenshot_analyzer.py for more info.
     screenshots_analysis_theoretical_fs: bool = False
     #
+    # Metrics (and their weights) screenshots are scored by
+    #
+    # "full": BRISQUE (55%), sharpness (20%) and file size (25%)
+    # "fast": Laplacian variance (40%), gradient energy (35%) and file size (25%),
+    #         computed by OpenCV on a 640px wide grayscale frame. Roughly 1/50th
+    #         of the CPU time of "full", e.g. for low-power machines.
+    # "custom": screenshots_scoring_weights
+    # See scorers.py for all metrics (and what they cost).
+    screenshots_scoring_profile: str = "full"
+    screenshots_scoring_weights: dict[str, float] = {
+        "brisque": 40.0, "sharpness": 20.0, "gradient": 15.0, "file_size": 25.0
+    }
+    #
+    # Maximum width (in pixels) at which the BRISQUE metric is computed
+    #
+    # Wider screenshots are downscaled (preserving aspect ratio) before scoring.
+    # Note: set to None to compute it at full resolution (slow)
+    screenshots_brisque_max_width: Optional[int] = 1280
+    #
+    # Compute BRISQUE features using the fast path
+    #
+    # Separable filtering, in-place arithmetic, cached distribution statistics and a
+    # cheaper factor-2 downscale. Features stay within a small tolerance of the
+    # reference implementation (checked by `python benchmark.py brisque_check`).
+    screenshots_brisque_fast: bool = False
+    #
+    # Number of screenshot scoring processes
+    #
+    # By default, it's picked based on the available CPUs and memory (respecting cgroup
+    # limits, e.g. in containers), the number of screenshots and their resolution.
+    # Note: set to None to pick it automatically
+    screenshots_scoring_processes: Optional[int] = None
+    #
+    # Where screenshots are scored
+    #
+    # "process" (a pool of processes), "thread" (a pool of threads of this process)
+    # or "serial" (this process only, one screenshot at a time). Most of the scoring
+    # releases the GIL, so threads save the processes' start-up, which matters
+    # for short runs (see `python benchmark.py executor`).
+    screenshots_scoring_executor: str = "process"
+    #
+    # Hand decoded frames to the scoring processes through shared memory
+    #
+    # Raw frames are copied into shared memory once, instead of being pickled for
+    # every scoring pass, and screenshot files are decoded once (in this process)
+    # instead of on every pass. Only used with the "process" executor.
+    screenshots_shared_memory: bool = True
+    #
+    # Start method of the (persistent) screenshot scoring processes
+    #
+    # "fork", "forkserver" or "spawn". With "forkserver" the heavy scoring modules
+    # (OpenCV, scikit-image, the BRISQUE model, ...) are imported only once, by the server.
+    # Note: set to None to use the platform's default
+    screenshots_pool_start_method: Optional[str] = None
+    #
+    # Skip BRISQUE for screenshots which can't make it into the top-K
+    #
+    # File size and sharpness are scored first. BRISQUE (55% of the full score) is only run
+    # on screenshots which could still beat the K-th best score with a perfect BRISQUE score,
+    # hence the picked screenshots are the same as without it.
+    # Note: not used if screenshots_streaming is set to True
+    screenshots_branch_and_bound: bool = True
+    #
+    # Maximum width (in pixels) at which the sharpness metric is computed
+    #
+    # Note: set to None to compute it at full resolution
+    screenshots_sharpness_max_width: Optional[int] = None
+    #
+    # Compute the sharpness metric in strips, reusing buffers in place
+    #
+    # Gives the same result, but bounds the memory needed per scoring process
+    # (see `python benchmark.py memory` and the README).
+    screenshots_sharpness_compact: bool = True
+    #
+    # Height (in rows) of the strips used by screenshots_sharpness_compact
+    #
+    # Note: set to None to process the whole image at once
+    screenshots_sharpness_strip_height: Optional[int] = 256
+    #
     # Number of screenshots to take for preprocessing
     #
     # Note: Pick a higher number than you want to upload
@@ -73,16 +152,131 @@ class Config:
     # Note: Set to 0 to disable. However, I recommend keeping this value to 3.
     screenshots_n_outlier_prunes: int = 3
     #
+    # Reject black, white, flat (e.g. fades) and credits frames before scoring them
+    #
+    # The checks (luma mean, luma histogram spread and edge density) run on small
+    # grayscale thumbnails (see frame_filter.py), before the file size statistics
+    # are computed. Rejected screenshots are replaced by ones taken at nearby
+    # timestamps (alternately later and earlier), up to screenshots_prefilter_resamples times.
+    # Note: set screenshots_prefilter_resamples to 0 to only drop them
+    # Note: the thumbnail checks are only run if screenshots_analyze is set to True
+    screenshots_prefilter: bool = True
+    screenshots_prefilter_resamples: int = 2
+    # Distance of the re-sampled timestamps (in seconds)
+    screenshots_prefilter_resample_offset: float = 5.0
+    # Let ffmpeg compute statistics (luma, blur and entropy, see ffmpeg_stats.py) of
+    # every screenshot while extracting it, which costs next to nothing
+    # None: don't
+    # "prefilter": reject black, flat and featureless screenshots based on them
+    #              (instead of on thumbnails, which also catch credits), then score the rest as usual
+    # "score": additionally use them as the scores, i.e. skip BRISQUE and
+    #          DOM sharpness altogether (much faster but cruder, e.g. for
+    #          low-power machines)
+    # Note: the blur estimate needs ffmpeg 5.1+ (it's left out otherwise)
+    screenshots_ffmpeg_stats: Optional[str] = None
+    # Group near-identical screenshots (e.g. several of the same static shot) by their
+    # perceptual hash (see frame_hash.py) and only score the largest one of every group,
+    # so the uploaded screenshots are visually distinct. Screenshots count as
+    # near-identical if their 64 bit hashes differ in at most
+    # screenshots_dedup_max_distance bits.
+    # Note: only used if screenshots_analyze is set to True and
+    # screenshots_ffmpeg_stats isn't set to "score"
+    screenshots_dedup: bool = True
+    screenshots_dedup_max_distance: int = 10
+    #
     # Number of screenshot to upload
     #
     screenshots_n_upload: int = 3
     #
+    # How screenshot timestamps (candidates) are picked
+    #
+    # "interval": the considered duration is divided into equal intervals
+    # "scene":    the interval timestamps are moved to nearby scene changes, which are
+    #             detected in a single low resolution, keyframe-only ffmpeg pass per file
+    # "packet_size": the keyframes with the largest compressed packets (i.e. the most
+    #             detailed ones) are picked. Only the demuxer is involved (requires ffprobe)
+    #             and it replaces the file size outlier pruning of screenshots.
+    screenshots_candidates: str = "interval"
+    #
     # ffmpeg Scene filter
     #
     # See https://jdhao.github.io/2021/12/25/ffmpeg-extract-key-frame-video/#extract-scene-changing-frames
     # Note: setting this variable to None means the filter won't be applied
-    # Note: currently unused
-    screenshots_ffmpeg_scene_filter: float = 0.4
+    # Note: only used if screenshots_candidates is set to "scene"
+    screenshots_ffmpeg_scene_filter: Optional[float] = 0.4
+    #
+    # Extract all screenshots of a file using a single ffmpeg process
+    #
+    # Otherwise a new ffmpeg process is spawned for every screenshot.
+    # Note: per-file extraction times are logged, so both modes can be compared.
+    screenshots_ffmpeg_single_process: bool = True
+    #
+    # Maximum number of ffmpeg processes extracting screenshots at the same time
+    #
+    # Extractions of different files and of different timestamps of
+    # the same file are spread over these workers.
+    # Note: set to 1 in order to extract everything sequentially.
+    screenshots_ffmpeg_workers: int = 4
+    #
+    # Move every screenshot timestamp to the nearest keyframe and decode only that keyframe
+    #
+    # Trades exact timestamps for (much) faster extraction, especially for long-GOP sources.
+    # Note: requires ffprobe. The distance each timestamp was moved is logged.
+    screenshots_keyframe_seek: bool = False
+    #
+    # How far (in seconds) to look around each timestamp for keyframes
+    #
+    # Only used if screenshots_keyframe_seek is set to True
+    screenshots_keyframe_search_window: float = 10.0
+    #
+    # Pipe decoded frames from ffmpeg straight into memory (as raw RGB)
+    #
+    # Frames are scored without being encoded to, written to and decoded from
+    # PNG files first. Only the screenshots picked for upload are written to disk.
+    # Note: file sizes are estimated by encoding the raw frames to PNG in memory (see screenshot_processor.py)
+    # Note: requires the analysis packages (numpy, OpenCV, Pillow)
+    screenshots_ffmpeg_raw_frames: bool = False
+    #
+    # Search for screenshots in two passes (coarse-to-fine)
+    #
+    # The first pass takes screenshots_n_coarse downscaled screenshots and ranks them
+    # by their file size and sharpness (i.e. without BRISQUE). The second pass takes
+    # full resolution screenshots at the best screenshots_n_preprocess timestamps,
+    # which are then analyzed as usual.
+    # Note: only used if screenshots_analyze is set to True
+    screenshots_two_pass: bool = False
+    #
+    # Refine the search around the best screenshots
+    #
+    # Once all screenshots are scored, screenshots_refine_n_frames more are taken within
+    # screenshots_refine_window seconds (before and after) of each of the top-K ones and
+    # scored. This is repeated around the new top-K with half the window, until it
+    # doesn't change anymore or the time (in seconds) or CPU (in CPU-seconds, including
+    # ffmpeg and the estimated busy time of the scoring processes) budget runs out.
+    # This finds better screenshots per CPU-second than raising screenshots_n_preprocess.
+    # Note: set a budget to None to disable it. Not used if screenshots_streaming is set
+    # to True or screenshots_ffmpeg_stats is set to "score".
+    screenshots_refine: bool = False
+    screenshots_refine_window: float = 4.0
+    screenshots_refine_n_frames: int = 4
+    screenshots_refine_time_budget: Optional[float] = 30.0
+    screenshots_refine_cpu_budget: Optional[float] = None
+    #
+    # Score screenshots while they're still being extracted
+    #
+    # Every screenshot is handed to the scoring processes as soon as its ffmpeg job
+    # finishes, instead of waiting for the whole extraction. File size outliers are
+    # pruned once all screenshots are in (using incrementally computed statistics).
+    # Note: only used if screenshots_analyze is set to True
+    screenshots_streaming: bool = False
+    #
+    # Number of screenshots to take in the first (coarse) pass
+    #
+    screenshots_n_coarse: int = 100
+    #
+    # Height (in pixels) of the first (coarse) pass screenshots
+    #
+    screenshots_coarse_height: int = 480
     #
     # Delete screenshots after they're not needed anymore
     #
@@ -93,6 +287,21 @@ class Config:
     # Note: Must be a valid *file* path.
     # e.g. /path/to/imgbox_history.json
     screenshots_imgbox_history: Optional[str] = None
+    #
+    # Cache screenshot scores in an SQLite database
+    #
+    # Scores are keyed by the source file (its size and a partial hash of its content),
+    # the timestamp of the screenshot and the scoring parameters (including the prefilter
+    # and deduplication settings). Screenshots found in
+    # the cache are neither extracted nor scored again, unless they're picked for upload.
+    # Note: set to None to disable. Not used together with screenshots_two_pass
+    # or screenshots_streaming.
+    screenshots_score_cache: Optional[str] = "~/.cache/prepare-torrent/scores.sqlite3"
+    #
+    # Maximum number of screenshots kept in the score cache
+    #
+    # The least recently used ones are evicted first.
+    screenshots_score_cache_max_entries: int = 100_000
 
     @staticmethod
     def binary_choice(description: str) -> bool:
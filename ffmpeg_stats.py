@@ -0,0 +1,143 @@
+import re
+import subprocess
+from pathlib import Path
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import Optional
+
+import scorers
+import frame_filter
+
+# Filters computing the statistics inside ffmpeg's filter graph (in this order)
+STATS_FILTERS = ["signalstats", "blurdetect", "entropy"]
+
+# blurdetect values of a sharp and of a (too) blurry frame
+BLUR_SHARP = 4.0
+BLUR_BLURRY = 30.0
+# Normalized luma entropy below which a frame is (nearly) uniform
+MIN_ENTROPY = 0.1
+
+
+@dataclass
+class FrameStats:
+    # Luma (converted to full range, 0-255): average, 10th and 90th percentile, maximum
+    luma_mean: float
+    luma_low: float
+    luma_high: float
+    luma_max: float
+    # blurdetect's estimate (the higher, the blurrier), None if the frame has no edges
+    blur: Optional[float] = None
+    # Normalized (0-1) entropy of the luma histogram
+    entropy: Optional[float] = None
+
+
+@lru_cache(maxsize=None)
+def available_filters() -> tuple[str, ...]:
+    # blurdetect needs ffmpeg 5.1+
+    try:
+        output = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-filters"], check=True, capture_output=True, text=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return ()
+
+    names = {line.split()[1] for line in output.splitlines() if len(line.split()) > 2}
+    return tuple(name for name in STATS_FILTERS if name in names)
+
+
+def escape_filter_value(value: str) -> str:
+    # Escapes an option value for both levels of ffmpeg's filter graph parsing
+    for c in "\\':":
+        value = value.replace(c, "\\" + c)
+    for c in "\\'[],;":
+        value = value.replace(c, "\\" + c)
+    return value
+
+
+def stats_filter(stats_file: Path, output: Optional[str] = None) -> Optional[str]:
+    # To be appended to a filter chain: writes the statistics of every frame passing
+    # through it to stats_file. They're computed on a branch converted to 8-bit
+    # (limited range) YUV, so the frames themselves aren't touched. The frames
+    # go to the given output label, or to the graph's output if there's none.
+    filters = available_filters()
+    if "signalstats" not in filters:
+        return None
+
+    label = output or "main"
+    metadata = f"metadata=mode=print:file={escape_filter_value(str(stats_file))}"
+    graph = f"split[{label}][stats];[stats]format=yuv420p,{','.join(filters)},{metadata},nullsink"
+    return graph if output else f"{graph};[{label}]null"
+
+
+def _full_range(value: float) -> float:
+    # 8-bit limited range (16-235) to 0-255
+    return min(255.0, max(0.0, (value - 16.0) * 255.0 / 219.0))
+
+
+def parse_stats(text: str) -> list[FrameStats]:
+    # Parses the output of the metadata filter (a "frame:N ..." line followed
+    # by "lavfi.key=value" lines for every frame), in the order of the frames
+    frames: list[dict[str, float]] = []
+    for line in text.splitlines():
+        if line.startswith("frame:"):
+            frames.append({})
+            continue
+
+        match = re.match(r"lavfi\.([\w.]+)=(-?[\d.]+(?:e[+-]?\d+)?)$", line.strip())
+        if match is not None and frames:
+            frames[-1][match.group(1)] = float(match.group(2))
+
+    stats: list[FrameStats] = []
+    for values in frames:
+        stats.append(FrameStats(
+            luma_mean=_full_range(values.get("signalstats.YAVG", 0.0)),
+            luma_low=_full_range(values.get("signalstats.YLOW", 0.0)),
+            luma_high=_full_range(values.get("signalstats.YHIGH", 0.0)),
+            luma_max=_full_range(values.get("signalstats.YMAX", 0.0)),
+            blur=values.get("blur"),
+            entropy=values.get("entropy.normalized_entropy.normal.Y"),
+        ))
+    return stats
+
+
+def read_stats(stats_file: Path) -> list[FrameStats]:
+    try:
+        return parse_stats(stats_file.read_text())
+    except OSError:
+        return []
+    finally:
+        stats_file.unlink(missing_ok=True)
+
+
+def rejection_reason(stats: FrameStats) -> Optional[str]:
+    # Same as frame_filter.rejection_reason, but based on ffmpeg's statistics. There's no
+    # credits check: the luma percentiles of text on black look like the ones of a dark scene
+    # with a lamp or a window in frame (most credits are rejected as black frames, though).
+    if stats.luma_mean < frame_filter.BLACK_MAX_LUMA:
+        return "black"
+    if stats.luma_mean > frame_filter.WHITE_MIN_LUMA:
+        return "white"
+
+    # Note: the spread between the 10th and 90th (instead of the 1st and 99th) percentile
+    if stats.luma_high - stats.luma_low < frame_filter.MIN_LUMA_SPREAD:
+        return "flat"
+    if stats.entropy is not None and stats.entropy < MIN_ENTROPY:
+        return "featureless"
+
+    return None
+
+
+def sharpness_score(stats: FrameStats) -> float:
+    # Weighted like the DOM sharpness score (of the scoring profile, see scorers.py)
+    if stats.blur is None:
+        return 0.0
+    sharpness = (BLUR_BLURRY - stats.blur) / (BLUR_BLURRY - BLUR_SHARP)
+    return scorers.weight("sharpness") * min(1.0, max(0.0, sharpness))
+
+
+def quality_score(stats: FrameStats) -> float:
+    # Weighted like the BRISQUE quality score (of the scoring profile). The amount
+    # of detail (entropy) is a (very) rough stand-in for BRISQUE's naturalness.
+    if stats.entropy is None:
+        return 0.0
+    return scorers.weight("brisque") * min(1.0, max(0.0, stats.entropy))
@@ -23,6 +23,13 @@ class FileMetadata:
             print(f"\nfailed to obtain video duration for file: {self.path.name}")
             print(f" --> exception: {e}\n")
 
+        self.width, self.height = 0, 0
+        try:
+            self.width, self.height = self.mediainfo.get_video_resolution()
+        except ValueError as e:
+            print(f"\nfailed to obtain video resolution for file: {self.path.name}")
+            print(f" --> exception: {e}\n")
+
     def _sanitize_filename(self) -> None:
         new_name = self.path.name.strip()\
             .replace(" ", ".")\
@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy
+
+# Width of the grayscale thumbnails the checks run on
+THUMBNAIL_WIDTH = 160
+
+# Average luma (0-255) below/above which a frame is black/white
+BLACK_MAX_LUMA = 24.0
+WHITE_MIN_LUMA = 232.0
+# Minimum difference between the 99th and 1st percentile of the luma (fades, solid colors)
+MIN_LUMA_SPREAD = 24.0
+# Luma below which a pixel is part of the (digital) black background of credits or a title card,
+# the share of such pixels and of the others (the text) of a credits frame, and the share of the
+# text pixels which are on an edge (thin strokes, unlike the smooth highlights of a dark scene)
+NEAR_BLACK_LUMA = 16
+CREDITS_MIN_BLACK_SHARE = 0.7
+CREDITS_MIN_TEXT_SHARE = 0.002
+CREDITS_MIN_TEXT_EDGE_SHARE = 0.4
+# Luma difference to a neighbouring pixel which counts as an edge
+EDGE_THRESHOLD = 20
+# Minimum share of edge pixels of any frame
+MIN_EDGE_DENSITY = 0.005
+
+
+def thumbnail(frame: "numpy.ndarray") -> "numpy.ndarray":
+    # Small 8-bit grayscale version of an RGB frame
+    import cv2
+
+    height, width = frame.shape[:2]
+    size = (THUMBNAIL_WIDTH, max(1, round(height * THUMBNAIL_WIDTH / width)))
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA) if width > THUMBNAIL_WIDTH else frame
+    return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+
+def thumbnail_of_file(path: Path) -> "numpy.ndarray":
+    from scoring_context import decode_image
+
+    return thumbnail(decode_image(path))
+
+
+def edge_density(gray: "numpy.ndarray") -> float:
+    # Share of pixels differing noticeably from their right or bottom neighbour
+    import numpy
+
+    luma = gray.astype(numpy.int16)
+    gradient = numpy.zeros_like(luma)
+    gradient[:, :-1] += numpy.abs(numpy.diff(luma, axis=1))
+    gradient[:-1, :] += numpy.abs(numpy.diff(luma, axis=0))
+    return float((gradient > EDGE_THRESHOLD).mean())
+
+
+def edge_mask(gray: "numpy.ndarray") -> "numpy.ndarray":
+    # Pixels differing noticeably from any of their neighbours (both pixels of an edge are marked)
+    import numpy
+
+    luma = gray.astype(numpy.int16)
+    dx = numpy.abs(numpy.diff(luma, axis=1)) > EDGE_THRESHOLD
+    dy = numpy.abs(numpy.diff(luma, axis=0)) > EDGE_THRESHOLD
+    mask = numpy.zeros(gray.shape, dtype=bool)
+    mask[:, :-1] |= dx
+    mask[:, 1:] |= dx
+    mask[:-1, :] |= dy
+    mask[1:, :] |= dy
+    return mask
+
+
+def is_credits(gray: "numpy.ndarray") -> bool:
+    # Text on a near-black background: (almost) everything that isn't black is on the edge of a
+    # thin, high-contrast stroke. Dark scenes have no digital black background, or smooth brighter
+    # areas (a lamp, the moon or a window), whose pixels are mostly not on an edge.
+    text = gray >= NEAR_BLACK_LUMA
+    text_share = float(text.mean())
+    if not CREDITS_MIN_TEXT_SHARE <= text_share <= 1.0 - CREDITS_MIN_BLACK_SHARE:
+        return False
+    return float(edge_mask(gray)[text].mean()) >= CREDITS_MIN_TEXT_EDGE_SHARE
+
+
+def luma_spread(gray: "numpy.ndarray") -> int:
+    # Difference between the 99th and 1st percentile of the luma histogram
+    import numpy
+
+    cumulative = numpy.bincount(gray.ravel(), minlength=256).cumsum()
+    low, high = numpy.searchsorted(cumulative, (0.01 * gray.size, 0.99 * gray.size))
+    return int(high - low)
+
+
+def rejection_reason(gray: "numpy.ndarray") -> Optional[str]:
+    # Why a frame (given as a thumbnail) is not worth scoring, or None if it is. Credits
+    # are checked first, as most of them (text on black) are black frames as well.
+    if is_credits(gray):
+        return "credits"
+
+    mean = float(gray.mean())
+    if mean < BLACK_MAX_LUMA:
+        return "black"
+    if mean > WHITE_MIN_LUMA:
+        return "white"
+
+    if luma_spread(gray) < MIN_LUMA_SPREAD:
+        return "flat"
+
+    if edge_density(gray) < MIN_EDGE_DENSITY:
+        return "featureless"
+
+    return None
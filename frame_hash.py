@@ -0,0 +1,32 @@
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy
+
+# dHash compares every pixel of a (HASH_SIZE + 1) x HASH_SIZE downscale
+# with its right neighbour, which makes for a HASH_SIZE^2 bit hash
+HASH_SIZE = 8
+
+
+def dhash(gray: "numpy.ndarray") -> int:
+    # Difference hash of an 8-bit grayscale frame (e.g. a frame_filter.thumbnail).
+    # It only depends on the rough structure of the frame, so it's (nearly) the
+    # same for frames of a static shot, regardless of noise, grain or compression.
+    import cv2
+    import numpy
+
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA).astype(numpy.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def find_near_duplicate(hash_: int, hashes: list[int], max_distance: int) -> Optional[int]:
+    # Index of the first of the hashes which is at most max_distance bits away, if any
+    for i, other in enumerate(hashes):
+        if hamming_distance(hash_, other) <= max_distance:
+            return i
+    return None
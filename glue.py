@@ -1,14 +1,17 @@
 import time
 import json
+import statistics
 import asyncio
 import pyimgbox
 from torf import Torrent
 from pathlib import Path
 from typing import Optional
 
+import scorers
 from config import Config
 from screenshot_taker import ScreenshotTaker
-from screenshot_processor import ScreenshotProcessor
+from screenshot_processor import ScreenshotProcessor, WorkerPool
+from score_cache import ScoreCache, get_score_cache
 from dir_metadata import DirMetadata
 from file_metadata import FileMetadata, FILE_EXTENSIONS
 
@@ -81,15 +84,102 @@ class Glue:
                 else:
                     self.screenshot_submissions.append(submission)
 
+    def _rank_coarse(self) -> list[tuple[FileMetadata, int]]:
+        # Coarse pass: many downscaled screenshots, cheaply ranked
+        self.screenshot_taker.generate_coarse()
+
+        coarse_processor = ScreenshotProcessor(
+            self.screenshot_taker.screenshots_dir,
+            frames=self.screenshot_taker.frames,
+            prefix="coarse"
+        )
+        best = coarse_processor.rank(Config.screenshots_n_preprocess)
+
+        print(f"taking full resolution screenshots at the best {len(best)} timestamps")
+        return [self.screenshot_taker.timestamps[screenshot.path] for screenshot in best]
+
+    def _process_cached(self, cache: ScoreCache) -> ScreenshotProcessor:
+        # Only screenshots which aren't in the score cache get extracted and scored
+        taker = self.screenshot_taker
+        try:
+            paths = taker.plan()
+            cached = cache.lookup({path: taker.timestamps[path] for path in paths})
+            print(f" --> found {len(cached)} of {len(paths)} screenshots in the score cache")
+
+            taker.extract([path for path in paths if path not in cached])
+
+            processor = ScreenshotProcessor(
+                taker.screenshots_dir,
+                frames=taker.frames,
+                cached=cached,
+                extract=taker.extract,
+                resample=taker.resample,
+                stats=taker.ffmpeg_stats,
+                refine=taker.refine,
+            )
+            processor.process()
+
+            cache.store(taker.timestamps, processor.metrics)
+            return processor
+        finally:
+            cache.close()
+
     def generate_screenshots(self) -> None:
         if self.screenshot_taker is None:
             return
 
+        # Scoring based on ffmpeg's statistics happens in no time, so there's
+        # nothing to gain from the two-pass search, streaming or the score cache
+        analyze = Config.screenshots_analyze and Config.screenshots_ffmpeg_stats != "score"
+
         try:
-            self.screenshot_taker.generate()
+            timestamps = None
+            if analyze and Config.screenshots_two_pass:
+                timestamps = self._rank_coarse()
+
+            if analyze and Config.screenshots_streaming:
+                processor = ScreenshotProcessor(
+                    self.screenshot_taker.screenshots_dir,
+                    resample=self.screenshot_taker.resample,
+                    stats=self.screenshot_taker.ffmpeg_stats,
+                )
+                if timestamps is not None:
+                    # Fine pass: full resolution screenshots at the best timestamps
+                    processor.process_streaming(
+                        lambda on_extracted: self.screenshot_taker.generate_at(timestamps, on_extracted)
+                    )
+                else:
+                    processor.process_streaming(self.screenshot_taker.generate)
+            else:
+                cache = None
+                # Only BRISQUE, sharpness and file size scores are cached (the others are cheap anyway)
+                if analyze and timestamps is None and not scorers.extra_metrics():
+                    cache = get_score_cache()
 
-            processor = ScreenshotProcessor(self.screenshot_taker.screenshots_dir)
-            processor.process()
+                if cache is not None:
+                    processor = self._process_cached(cache)
+                else:
+                    if timestamps is not None:
+                        self.screenshot_taker.generate_at(timestamps)
+                    else:
+                        self.screenshot_taker.generate()
+
+                    processor = ScreenshotProcessor(
+                        self.screenshot_taker.screenshots_dir,
+                        frames=self.screenshot_taker.frames,
+                        resample=self.screenshot_taker.resample,
+                        stats=self.screenshot_taker.ffmpeg_stats,
+                        refine=self.screenshot_taker.refine,
+                    )
+                    processor.process()
+
+            cpu_seconds = self.screenshot_taker.cpu_seconds
+            if processor.scores and cpu_seconds > 0:
+                mean_score = statistics.mean(score.total_score() for score in processor.scores)
+                print(
+                    f" --> mean score of {mean_score:.2f} points using {cpu_seconds:.2f} ffmpeg CPU-seconds "
+                    f"({mean_score / cpu_seconds:.2f} points per CPU-second)"
+                )
 
             paths = [str(screenshot.path) for screenshot in processor.screenshots]
             if not paths:
@@ -120,6 +210,7 @@ class Glue:
 
                     print(" --> done!")
         finally:
+            WorkerPool.shutdown()
             self.screenshot_taker.cleanup()
 
     @staticmethod
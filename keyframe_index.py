@@ -0,0 +1,97 @@
+import bisect
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Keyframe:
+    # note: the timestamp is in miliseconds
+    msec: int
+    # size of the compressed packet in bytes
+    size: int
+
+
+class KeyframeIndex:
+    # Reads the keyframe packets of the first video stream using ffprobe.
+    #
+    # Only the demuxer is involved (no frames are decoded). If intervals
+    # (in miliseconds) are given, then only packets from those parts of the
+    # file are read, otherwise the whole file is read.
+    def __init__(self, path: Path, intervals: Optional[list[tuple[int, int]]] = None):
+        self.path = path
+        self.keyframes: list[Keyframe] = []
+
+        read_intervals: list[str] = []
+        if intervals:
+            read_intervals = [
+                "-read_intervals",
+                ",".join(f"{max(0, start) / 1000:.3f}%{end / 1000:.3f}" for start, end in intervals),
+            ]
+
+        output = subprocess.run(
+            executable="ffprobe",
+            args=[
+                "ffprobe",
+                # throw an error if something goes wrong
+                "-loglevel", "error",
+                # first video stream (ignoring cover art)
+                "-select_streams", "V:0",
+                *read_intervals,
+                # packet info only, i.e. don't decode anything
+                "-show_entries", "packet=pts_time,size,flags",
+                # one "key=value|key=value" line per packet
+                "-of", "compact=p=0",
+                str(path),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+        seen: set[int] = set()
+        for line in output.splitlines():
+            keyframe = self._parse_packet(line)
+            if keyframe is None or keyframe.msec in seen:
+                continue
+
+            seen.add(keyframe.msec)
+            self.keyframes.append(keyframe)
+
+        self.keyframes = sorted(self.keyframes, key=lambda x: x.msec)
+        self._msecs = [k.msec for k in self.keyframes]
+
+    @staticmethod
+    def _parse_packet(line: str) -> Optional[Keyframe]:
+        fields = dict(
+            field.split("=", 1) for field in line.strip().split("|") if "=" in field
+        )
+        if "K" not in fields.get("flags", ""):
+            return None
+
+        try:
+            # floor the timestamp, so seeking to it never skips past the keyframe
+            msec = int(float(fields["pts_time"]) * 1000)
+            size = int(fields["size"])
+        except (KeyError, ValueError):
+            return None
+
+        return Keyframe(msec=msec, size=size)
+
+    def __len__(self) -> int:
+        return len(self.keyframes)
+
+    def nearest(self, msec: int, lower: int, upper: int) -> Optional[Keyframe]:
+        # Find the keyframe closest to msec within [lower, upper]
+        i = bisect.bisect_left(self._msecs, msec)
+
+        best = None
+        for keyframe in self.keyframes[max(0, i - 1):i + 1]:
+            if not lower <= keyframe.msec <= upper:
+                continue
+
+            if best is None or abs(keyframe.msec - msec) < abs(best.msec - msec):
+                best = keyframe
+
+        return best
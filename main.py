@@ -50,6 +50,13 @@ if __name__ == "__main__":
         help="Toggles the prompt dialog if --sanitize-file-name is enabled",
         dest="ss_no_spoilers",
     )
+    parser.add_argument(
+        "--ss-scoring-profile",
+        type=str,
+        choices=["full", "fast", "custom"],
+        help="Metrics screenshots are scored by: BRISQUE, sharpness and file size, cheap OpenCV ones, "
+             "or the weights set in the config",
+    )
     parser.add_argument(
         "--ss-n-preprocess",
         type=int,
@@ -62,12 +69,154 @@ if __name__ == "__main__":
         metavar="N",
         help="Maximum number of outlier screenshots to prune from the upper and lower bounds (symetrically)",
     )
+    parser.add_argument(
+        "--ss-prefilter",
+        action=argparse.BooleanOptionalAction,
+        help="Reject black, flat and credits screenshots (on thumbnails) before scoring them",
+    )
+    parser.add_argument(
+        "--ss-prefilter-resamples",
+        type=int,
+        metavar="N",
+        help="Number of times to replace a rejected screenshot by one taken at a nearby timestamp",
+    )
+    parser.add_argument(
+        "--ss-ffmpeg-stats",
+        type=str,
+        choices=["prefilter", "score"],
+        help="Let ffmpeg compute screenshot statistics to prefilter (or also score) the screenshots",
+    )
+    parser.add_argument(
+        "--ss-dedup",
+        action=argparse.BooleanOptionalAction,
+        help="Only score one of every group of near-identical screenshots (by their perceptual hash)",
+    )
+    parser.add_argument(
+        "--ss-dedup-max-distance",
+        type=int,
+        metavar="N",
+        help="Number of (out of 64) hash bits in which near-identical screenshots may differ",
+    )
     parser.add_argument(
         "--ss-n-upload",
         type=int,
         metavar="N",
         help="Number of screenshots to upload (after analyzing them and selecting the best)",
     )
+    parser.add_argument(
+        "--ss-ffmpeg-single-process",
+        action=argparse.BooleanOptionalAction,
+        help="Extract all screenshots of a file using a single ffmpeg process",
+        dest="ss_ffmpeg_single_process",
+    )
+    parser.add_argument(
+        "--ss-ffmpeg-workers",
+        type=int,
+        metavar="N",
+        help="Maximum number of ffmpeg processes extracting screenshots at the same time",
+    )
+    parser.add_argument(
+        "--ss-keyframe-seek",
+        action=argparse.BooleanOptionalAction,
+        help="Move screenshot timestamps to the nearest keyframe and only decode keyframes",
+        dest="ss_keyframe_seek",
+    )
+    parser.add_argument(
+        "--ss-ffmpeg-raw-frames",
+        action=argparse.BooleanOptionalAction,
+        help="Pipe decoded frames from ffmpeg into memory and only write the uploaded screenshots to disk",
+        dest="ss_ffmpeg_raw_frames",
+    )
+    parser.add_argument(
+        "--ss-two-pass",
+        action=argparse.BooleanOptionalAction,
+        help="Rank many downscaled screenshots first and only analyze the best ones at full resolution",
+        dest="ss_two_pass",
+    )
+    parser.add_argument(
+        "--ss-streaming",
+        action=argparse.BooleanOptionalAction,
+        help="Score screenshots while they're still being extracted",
+        dest="ss_streaming",
+    )
+    parser.add_argument(
+        "--ss-refine",
+        action=argparse.BooleanOptionalAction,
+        help="Take and score more screenshots around the best ones (within a time or CPU budget)",
+        dest="ss_refine",
+    )
+    parser.add_argument(
+        "--ss-refine-time-budget",
+        type=float,
+        metavar="SECONDS",
+        help="Time after which --ss-refine stops",
+    )
+    parser.add_argument(
+        "--ss-refine-cpu-budget",
+        type=float,
+        metavar="SECONDS",
+        help="CPU time (including ffmpeg and the scoring processes) after which --ss-refine stops",
+    )
+    parser.add_argument(
+        "--ss-n-coarse",
+        type=int,
+        metavar="N",
+        help="Number of downscaled screenshots to take in the first pass of --ss-two-pass",
+    )
+    parser.add_argument(
+        "--ss-candidates",
+        type=str,
+        choices=["interval", "scene", "packet_size"],
+        help="How screenshot timestamps are picked: at fixed intervals, near scene changes or "
+             "at the largest keyframes",
+    )
+    parser.add_argument(
+        "--ss-brisque-fast",
+        action=argparse.BooleanOptionalAction,
+        help="Compute BRISQUE features using the fast path (within a small tolerance of the reference)",
+        dest="ss_brisque_fast",
+    )
+    parser.add_argument(
+        "--ss-sharpness-compact",
+        action=argparse.BooleanOptionalAction,
+        help="Compute the sharpness metric in strips (same result, bounded memory usage)",
+        dest="ss_sharpness_compact",
+    )
+    parser.add_argument(
+        "--ss-branch-and-bound",
+        action=argparse.BooleanOptionalAction,
+        help="Skip BRISQUE for screenshots which can't make it into the top-K",
+        dest="ss_branch_and_bound",
+    )
+    parser.add_argument(
+        "--ss-scoring-processes",
+        type=int,
+        metavar="N",
+        help="Number of screenshot scoring processes (picked automatically by default)",
+    )
+    parser.add_argument(
+        "--ss-scoring-executor",
+        type=str,
+        choices=["process", "thread", "serial"],
+        help="Run the screenshot scoring in processes, threads or serially",
+    )
+    parser.add_argument(
+        "--ss-shared-memory",
+        action=argparse.BooleanOptionalAction,
+        help="Hand decoded frames to the scoring processes through shared memory",
+    )
+    parser.add_argument(
+        "--ss-pool-start-method",
+        type=str,
+        choices=["fork", "forkserver", "spawn"],
+        help="Start method of the screenshot scoring processes",
+    )
+    parser.add_argument(
+        "--no-score-cache",
+        action="store_true",
+        help="Don't reuse (or save) the scores of screenshots taken in previous runs",
+        dest="no_score_cache",
+    )
     parser.add_argument(
         "--ss-delete-after-use",
         action=argparse.BooleanOptionalAction,
@@ -101,15 +250,90 @@ if __name__ == "__main__":
     if args.ss_no_spoilers is not None:
         Config.screenshots_no_spoilers = args.ss_no_spoilers
 
+    if args.ss_scoring_profile is not None:
+        Config.screenshots_scoring_profile = args.ss_scoring_profile
+
     if args.ss_n_preprocess is not None:
         Config.screenshots_n_preprocess = args.ss_n_preprocess
 
     if args.ss_n_outlier_prunes is not None:
         Config.screenshots_n_outlier_prunes = args.ss_n_outlier_prunes
 
+    if args.ss_prefilter is not None:
+        Config.screenshots_prefilter = args.ss_prefilter
+
+    if args.ss_prefilter_resamples is not None:
+        Config.screenshots_prefilter_resamples = args.ss_prefilter_resamples
+
+    if args.ss_ffmpeg_stats is not None:
+        Config.screenshots_ffmpeg_stats = args.ss_ffmpeg_stats
+
+    if args.ss_dedup is not None:
+        Config.screenshots_dedup = args.ss_dedup
+
+    if args.ss_dedup_max_distance is not None:
+        Config.screenshots_dedup_max_distance = args.ss_dedup_max_distance
+
     if args.ss_n_upload is not None:
         Config.screenshots_n_upload = args.ss_n_upload
 
+    if args.ss_ffmpeg_single_process is not None:
+        Config.screenshots_ffmpeg_single_process = args.ss_ffmpeg_single_process
+
+    if args.ss_ffmpeg_workers is not None:
+        Config.screenshots_ffmpeg_workers = args.ss_ffmpeg_workers
+
+    if args.ss_keyframe_seek is not None:
+        Config.screenshots_keyframe_seek = args.ss_keyframe_seek
+
+    if args.ss_ffmpeg_raw_frames is not None:
+        Config.screenshots_ffmpeg_raw_frames = args.ss_ffmpeg_raw_frames
+
+    if args.ss_two_pass is not None:
+        Config.screenshots_two_pass = args.ss_two_pass
+
+    if args.ss_streaming is not None:
+        Config.screenshots_streaming = args.ss_streaming
+
+    if args.ss_refine is not None:
+        Config.screenshots_refine = args.ss_refine
+
+    if args.ss_refine_time_budget is not None:
+        Config.screenshots_refine_time_budget = args.ss_refine_time_budget
+
+    if args.ss_refine_cpu_budget is not None:
+        Config.screenshots_refine_cpu_budget = args.ss_refine_cpu_budget
+
+    if args.ss_n_coarse is not None:
+        Config.screenshots_n_coarse = args.ss_n_coarse
+
+    if args.ss_candidates is not None:
+        Config.screenshots_candidates = args.ss_candidates
+
+    if args.ss_brisque_fast is not None:
+        Config.screenshots_brisque_fast = args.ss_brisque_fast
+
+    if args.ss_sharpness_compact is not None:
+        Config.screenshots_sharpness_compact = args.ss_sharpness_compact
+
+    if args.ss_branch_and_bound is not None:
+        Config.screenshots_branch_and_bound = args.ss_branch_and_bound
+
+    if args.ss_scoring_processes is not None:
+        Config.screenshots_scoring_processes = args.ss_scoring_processes
+
+    if args.ss_scoring_executor is not None:
+        Config.screenshots_scoring_executor = args.ss_scoring_executor
+
+    if args.ss_shared_memory is not None:
+        Config.screenshots_shared_memory = args.ss_shared_memory
+
+    if args.ss_pool_start_method is not None:
+        Config.screenshots_pool_start_method = args.ss_pool_start_method
+
+    if args.no_score_cache:
+        Config.screenshots_score_cache = None
+
     if args.ss_delete_after_use is not None:
         Config.screenshots_delete_after_use = args.ss_delete_after_use
 
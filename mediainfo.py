@@ -35,3 +35,16 @@ class MediaInfoParser:
                 return float(t.duration)
 
         raise ValueError("failed to obtain video track duration")
+
+    # throws a ValueError exception on error
+    # note: returns the (width, height) of the stored frames, in pixels
+    def get_video_resolution(self) -> tuple[int, int]:
+        video_tracks = self.media_info.video_tracks
+        if not video_tracks:
+            raise ValueError("mediainfo is missing a video track")
+
+        for t in video_tracks:
+            if t.width and t.height:
+                return int(t.width), int(t.height)
+
+        raise ValueError("failed to obtain video track resolution")
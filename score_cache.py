@@ -0,0 +1,182 @@
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional
+
+import scorers
+from config import Config
+from file_metadata import FileMetadata
+
+# Bump this if the way screenshots are scored changes
+SCORE_CACHE_VERSION = 1
+
+# Number of bytes hashed at the start, in the middle and at the end of a source file
+PARTIAL_HASH_BLOCK_SIZE = 64 * 1024
+
+
+@dataclass
+class ScreenshotMetrics:
+    # (estimated) file size of the screenshot in bytes
+    file_size: int
+    # None if the screenshot wasn't analyzed (e.g. if it was a file size outlier)
+    sharpness_score: Optional[float] = None
+    # None if BRISQUE wasn't run on the screenshot
+    quality_score: Optional[float] = None
+    # Perceptual hash (see frame_hash.py), None if the screenshot wasn't hashed
+    dhash: Optional[int] = None
+
+
+def source_identity(path: Path) -> str:
+    # Identifies a source file by its size and a hash of a few blocks of its content,
+    # so it's recognized even after being moved or copied (unlike by its inode/mtime)
+    size = path.stat().st_size
+
+    digest = hashlib.sha1()
+    with path.open("rb") as fp:
+        for offset in (0, size // 2, max(0, size - PARTIAL_HASH_BLOCK_SIZE)):
+            fp.seek(offset)
+            digest.update(fp.read(PARTIAL_HASH_BLOCK_SIZE))
+
+    return f"{size}:{digest.hexdigest()}"
+
+
+def scoring_parameters() -> str:
+    # Everything the extracted frames and their scores depend on
+    parameters = {
+        "version": SCORE_CACHE_VERSION,
+        "ffmpeg_raw_frames": Config.screenshots_ffmpeg_raw_frames,
+        "keyframe_seek": Config.screenshots_keyframe_seek,
+        "keyframes_only": Config.screenshots_candidates == "packet_size",
+        "brisque_max_width": Config.screenshots_brisque_max_width,
+        "brisque_fast": Config.screenshots_brisque_fast,
+        "sharpness_max_width": Config.screenshots_sharpness_max_width,
+        # Cached screenshots skip the prefilter (rejected ones aren't cached)
+        # and the deduplication, so they must have been run the same way
+        "prefilter": Config.screenshots_prefilter,
+        "ffmpeg_stats": Config.screenshots_ffmpeg_stats,
+        "dedup": Config.screenshots_dedup,
+        # The cached scores are weighted
+        "weights": scorers.profile_weights(),
+    }
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class ScoreCache:
+    # SQLite database of screenshot metrics, keyed by the source file, the timestamp
+    # of the screenshot and the scoring parameters. The least recently used entries
+    # are evicted once there are more than max_entries.
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._parameters = scoring_parameters()
+        self._sources: dict[Path, str] = {}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "source TEXT NOT NULL, "
+            "msec INTEGER NOT NULL, "
+            "parameters TEXT NOT NULL, "
+            "file_size INTEGER NOT NULL, "
+            "sharpness_score REAL, "
+            "quality_score REAL, "
+            "dhash TEXT, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (source, msec, parameters))"
+        )
+        # Databases created before the perceptual hashes were cached
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(scores)")}
+        if "dhash" not in columns:
+            self._db.execute("ALTER TABLE scores ADD COLUMN dhash TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self._db.commit()
+
+    def _source(self, file: FileMetadata) -> str:
+        if file.path not in self._sources:
+            self._sources[file.path] = source_identity(file.path)
+        return self._sources[file.path]
+
+    def lookup(self, screenshots: dict[Path, tuple[FileMetadata, int]]) -> dict[Path, ScreenshotMetrics]:
+        # Returns the cached metrics of the given screenshots (by their path)
+        hits: dict[Path, ScreenshotMetrics] = {}
+        now = time.time()
+
+        for path, (file, msec) in screenshots.items():
+            key = (self._source(file), msec, self._parameters)
+            row = self._db.execute(
+                "SELECT file_size, sharpness_score, quality_score, dhash FROM scores "
+                "WHERE source = ? AND msec = ? AND parameters = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                continue
+
+            hits[path] = ScreenshotMetrics(
+                file_size=row[0],
+                sharpness_score=row[1],
+                quality_score=row[2],
+                # stored as hex, as SQLite's integers are signed 64-bit
+                dhash=int(row[3], 16) if row[3] is not None else None,
+            )
+            self._db.execute(
+                "UPDATE scores SET last_used = ? WHERE source = ? AND msec = ? AND parameters = ?",
+                (now, *key),
+            )
+
+        self._db.commit()
+        return hits
+
+    def store(
+        self, screenshots: dict[Path, tuple[FileMetadata, int]], metrics: dict[Path, ScreenshotMetrics]
+    ) -> None:
+        now = time.time()
+        for path, m in metrics.items():
+            if path not in screenshots:
+                continue
+
+            file, msec = screenshots[path]
+            # Keep previously cached metrics which weren't computed this time
+            self._db.execute(
+                "INSERT INTO scores "
+                "(source, msec, parameters, file_size, sharpness_score, quality_score, dhash, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (source, msec, parameters) DO UPDATE SET "
+                "file_size = excluded.file_size, "
+                "sharpness_score = COALESCE(excluded.sharpness_score, sharpness_score), "
+                "quality_score = COALESCE(excluded.quality_score, quality_score), "
+                "dhash = COALESCE(excluded.dhash, dhash), "
+                "last_used = excluded.last_used",
+                (
+                    self._source(file), msec, self._parameters, m.file_size, m.sharpness_score,
+                    m.quality_score, f"{m.dhash:x}" if m.dhash is not None else None, now,
+                ),
+            )
+
+        # Least recently used entries go first
+        self._db.execute(
+            "DELETE FROM scores WHERE rowid IN "
+            "(SELECT rowid FROM scores ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def get_score_cache() -> Optional[ScoreCache]:
+    if not Config.screenshots_score_cache:
+        return None
+
+    try:
+        return ScoreCache(
+            Path(Config.screenshots_score_cache).expanduser(),
+            max_entries=Config.screenshots_score_cache_max_entries,
+        )
+    except Exception as e:
+        print(f" --> couldn't open the score cache: {e}")
+        return None
@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+from typing import Callable, Optional, TYPE_CHECKING
+
+from config import Config
+
+if TYPE_CHECKING:
+    from scoring_context import ScoringContext
+
+# Laplacian variance and gradient energy (of a fast_gray view) at which
+# their metrics reach half of their weight. Both grow with the amount of detail.
+LAPLACIAN_VARIANCE_HALF = 250.0
+GRADIENT_ENERGY_HALF = 2500.0
+# Views of the ScoringContext which need the colours of a frame (the others are grayscale)
+COLOR_INPUTS = {"brisque_image"}
+# Modules every scoring worker needs
+BASE_MODULES = ["numpy", "cv2", "scoring_context"]
+
+
+@dataclass(frozen=True)
+class Metric:
+    name: str
+    # Rough CPU time (in milliseconds) per 1080p frame (see `python benchmark.py scorers`)
+    cost_ms: float
+    # Views of the ScoringContext it needs (file_size needs none, not even a decoded frame)
+    inputs: tuple[str, ...]
+    # Modules it needs, which the scoring workers load when they're started
+    modules: tuple[str, ...] = ()
+    # Maps the context to 0-1 (the higher, the better). The metrics the scoring
+    # pipeline handles itself (BRISQUE, DOM sharpness and file size) have none.
+    compute: Optional[Callable[["ScoringContext"], float]] = None
+
+
+METRICS: dict[str, Metric] = {}
+
+
+def register(metric: Metric) -> Metric:
+    METRICS[metric.name] = metric
+    return metric
+
+
+def _saturate(value: float, half: float) -> float:
+    # 0 -> 0, half -> 0.5, approaching 1 for large values
+    return value / (value + half)
+
+
+def laplacian_variance(context: "ScoringContext") -> float:
+    # Variance of the Laplacian, a classic focus measure (blurry frames have few strong second derivatives)
+    import cv2
+
+    return _saturate(float(cv2.Laplacian(context.fast_gray, cv2.CV_32F).var()), LAPLACIAN_VARIANCE_HALF)
+
+
+def gradient_energy(context: "ScoringContext") -> float:
+    # Mean squared Sobel gradient magnitude (Tenengrad), i.e. the amount of detail
+    import cv2
+
+    gray = context.fast_gray
+    dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0)
+    dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1)
+    energy = float((dx * dx + dy * dy).mean())
+    return _saturate(energy, GRADIENT_ENERGY_HALF)
+
+
+# brisque loads its SVM model and normalization parameters when imported
+register(Metric(
+    "brisque", cost_ms=120.0, inputs=("brisque_image",), modules=("scipy.signal", "skimage.transform", "brisque")
+))
+register(Metric("sharpness", cost_ms=300.0, inputs=("sharpness_image",), modules=("sharpness",)))
+register(Metric("file_size", cost_ms=0.0, inputs=()))
+register(Metric("laplacian", cost_ms=2.0, inputs=("fast_gray",), compute=laplacian_variance))
+register(Metric("gradient", cost_ms=3.0, inputs=("fast_gray",), compute=gradient_energy))
+
+# Weights (in points, adding up to 100) of the metrics of every profile
+PROFILES: dict[str, dict[str, float]] = {
+    "full": {"brisque": 55.0, "sharpness": 20.0, "file_size": 25.0},
+    "fast": {"laplacian": 40.0, "gradient": 35.0, "file_size": 25.0},
+}
+
+
+def profile_weights() -> dict[str, float]:
+    # Weights of the metrics of the configured profile (metrics weighted 0 are left out)
+    profile = Config.screenshots_scoring_profile
+    if profile == "custom":
+        weights = Config.screenshots_scoring_weights
+    elif profile in PROFILES:
+        weights = PROFILES[profile]
+    else:
+        raise ValueError(f"unknown screenshot scoring profile: {profile}")
+
+    for name in weights:
+        if name not in METRICS:
+            raise ValueError(f"unknown screenshot metric: {name}")
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def weight(name: str) -> float:
+    return profile_weights().get(name, 0.0)
+
+
+def extra_metrics() -> list[tuple[Metric, float]]:
+    # The weighted metrics of the profile which are computed from a ScoringContext
+    return [(METRICS[name], w) for name, w in profile_weights().items() if METRICS[name].compute is not None]
+
+
+def cost_ms(width: int = 1920, height: int = 1080) -> float:
+    # Estimated CPU time per frame of the configured profile. Every metric but
+    # the ones on fast_gray (which has a fixed size) scales with the resolution.
+    scale = width * height / (1920 * 1080)
+    return sum(
+        METRICS[name].cost_ms * (1.0 if METRICS[name].inputs == ("fast_gray",) else scale)
+        for name in profile_weights()
+    )
+
+
+def needs_color() -> bool:
+    # Whether screenshot files must be decoded in colour (otherwise grayscale will do)
+    return any(set(METRICS[name].inputs) & COLOR_INPUTS for name in profile_weights())
+
+
+def worker_modules() -> list[str]:
+    # Modules the scoring workers preload for the configured profile
+    modules = list(BASE_MODULES)
+    for name in profile_weights():
+        modules += [module for module in METRICS[name].modules if module not in modules]
+    return modules
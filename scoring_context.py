@@ -0,0 +1,96 @@
+from pathlib import Path
+from functools import cached_property
+from typing import Optional
+
+import cv2
+import numpy
+from PIL import Image
+
+# Width of the grayscale view of the cheap ("fast" profile) metrics
+FAST_WIDTH = 640
+
+
+def resize_to_width(image: numpy.ndarray, max_width: Optional[int]) -> numpy.ndarray:
+    # If image is wider than max_width resize it to
+    # (w=max_width, h=<calculated based on aspect ratio>)
+    if max_width is None or image.shape[1] <= max_width:
+        return image
+
+    new_height = int(float(image.shape[0]) * float(max_width / float(image.shape[1])))
+    resized = Image.fromarray(image).resize((max_width, new_height), Image.Resampling.LANCZOS)
+    return numpy.asarray(resized)
+
+
+def decode_image(path: Path, mode: str = "RGB") -> numpy.ndarray:
+    # See https://stackoverflow.com/questions/57565234/pil-not-always-using-3-channels-for-png
+    # NOTE: PIL.Image.open is a lazy evaluation. This line is needed to force to load content.
+    image = Image.open(path).convert(mode)
+    image.load()
+    return numpy.asarray(image)
+
+
+class ScoringContext:
+    # Decodes a screenshot once and lazily derives the views the metrics need,
+    # so that no metric has to read or decode the image on its own.
+    # If grayscale is set (no metric needs colours, see scorers.needs_color),
+    # a screenshot file is decoded to grayscale only, and there's no rgb view.
+    def __init__(
+        self,
+        path: Path,
+        frame: Optional[numpy.ndarray] = None,
+        brisque_max_width: Optional[int] = 1280,
+        sharpness_max_width: Optional[int] = None,
+        grayscale: bool = False,
+    ):
+        self.path = path
+        self.brisque_max_width = brisque_max_width
+        self.sharpness_max_width = sharpness_max_width
+
+        if frame is not None:
+            self.rgb = frame
+        elif grayscale:
+            self.gray = decode_image(path, mode="L")
+        else:
+            self.rgb = decode_image(path)
+
+    @property
+    def _decoded(self) -> numpy.ndarray:
+        return self.__dict__["rgb"] if "rgb" in self.__dict__ else self.gray
+
+    @property
+    def width(self) -> int:
+        return self._decoded.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._decoded.shape[0]
+
+    @cached_property
+    def gray(self) -> numpy.ndarray:
+        # Full resolution 8-bit grayscale
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def brisque_image(self) -> numpy.ndarray:
+        # RGB, at most brisque_max_width pixels wide
+        return resize_to_width(self.rgb, self.brisque_max_width)
+
+    @cached_property
+    def sharpness_image(self) -> numpy.ndarray:
+        # 8-bit grayscale, at most sharpness_max_width pixels wide
+        return resize_to_width(self.gray, self.sharpness_max_width)
+
+    @cached_property
+    def fast_gray(self) -> numpy.ndarray:
+        # 8-bit grayscale, at most FAST_WIDTH pixels wide. Downscaled (by OpenCV)
+        # before the conversion, so the full resolution frame is only read once.
+        if self.width <= FAST_WIDTH:
+            return self.gray
+        size = (FAST_WIDTH, max(1, round(self.height * FAST_WIDTH / self.width)))
+        small = cv2.resize(self._decoded, size, interpolation=cv2.INTER_AREA)
+        return small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    def release(self) -> None:
+        # Drops the frame and every view derived from it (needed if the frame is in shared memory)
+        for name in ("rgb", "gray", "brisque_image", "sharpness_image", "fast_gray"):
+            self.__dict__.pop(name, None)
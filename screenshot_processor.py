@@ -1,14 +1,54 @@
+import os
 import math
+import time
+import heapq
+import queue
+import atexit
+import threading
 import statistics
+import multiprocessing
 from pathlib import Path
-from dataclasses import dataclass
-from multiprocessing import cpu_count, Pool
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.pool import Pool, ThreadPool
+from typing import Any, Callable, Iterator, Optional, Union, TYPE_CHECKING
 
+import scorers
+import ffmpeg_stats
 from config import Config
+from score_cache import ScreenshotMetrics
+from ffmpeg_stats import FrameStats
+from frame_filter import rejection_reason, thumbnail, thumbnail_of_file
+from frame_hash import dhash, find_near_duplicate
+from shared_frames import SharedFrame, SharedFrameStore
+from screenshot_taker import ExtractedCallback, RawFrame, children_cpu_seconds
+from system_resources import available_cpus, available_memory_mb, available_shared_memory_mb
+
+if TYPE_CHECKING:
+    import numpy
+    from scoring_context import ScoringContext
+
+# A screenshot file, or an extracted raw frame (and the path it'd be written to)
+Candidate = tuple[Path, Optional["numpy.ndarray"]]
 
 
 SQRT2 = math.sqrt(2.0)
 TEN_MB = 10 * 1024 * 1024
+# Refinement stops once its window would be narrower than this (in seconds)
+MIN_REFINE_WINDOW = 0.25
+
+# The modules the scoring workers need (see scorers.worker_modules) are loaded once per
+# worker (or once in total, for the forkserver start method) instead of per task.
+# Part of a scoring process' RSS taken by the modules of the full profile
+# (see `python benchmark.py memory`), which scoring threads share
+WORKER_MODULES_RSS_MB = 140.0
+# Rough start-up time of a scoring process. Processes which wouldn't have
+# more scoring work than that aren't worth starting.
+WORKER_STARTUP_MS = 500.0
+# Resolution assumed for sizing the scoring pool if it isn't known
+WORST_CASE_RESOLUTION = (3840, 2160)
 
 
 @dataclass
@@ -16,6 +56,23 @@ class ScreenshotMetadata:
     path: Path
     file_size: int
     max_file_size: int
+    # Decoded RGB frame (if screenshots were extracted as raw frames).
+    # In that case, the file at path is only written if the frame gets uploaded
+    # and file_size is an estimate.
+    frame: Optional["numpy.ndarray"] = None
+    # The decoded frame in shared memory (see ScreenshotProcessor._share_frames)
+    shared_frame: Optional[SharedFrame] = None
+    # The decoded screenshot file, if the prefilter had to decode it anyway
+    # (see ScreenshotProcessor._filter_degenerate)
+    decoded: Optional["numpy.ndarray"] = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Frames in shared memory are sent to the scoring processes by name only
+        state = self.__dict__.copy()
+        if self.shared_frame is not None:
+            state["frame"] = None
+            state["decoded"] = None
+        return state
 
 
 @dataclass
@@ -24,57 +81,476 @@ class ImageScore:
     fs_score: float
     quality_score: float
     sharpness_score: float
+    # Unscaled BRISQUE features, until quality_score gets filled in by score_quality
+    brisque_features: Optional["numpy.ndarray"] = None
+    # Scores of the profile's other metrics (see scorers.py), by their name
+    extra_scores: dict[str, float] = field(default_factory=dict)
 
     def total_score(self) -> float:
-        return self.fs_score + self.quality_score + self.sharpness_score
+        return self.fs_score + self.quality_score + self.sharpness_score + sum(self.extra_scores.values())
 
     def __str__(self) -> str:
-        return f"{self.fs_score:.02f}% FS, {self.quality_score:.02f}% quality, {self.sharpness_score:.02f}% sharpness"
+        extra = "".join(f", {score:.02f}% {name}" for name, score in self.extra_scores.items())
+        return (
+            f"{self.fs_score:.02f}% FS, {self.quality_score:.02f}% quality, "
+            f"{self.sharpness_score:.02f}% sharpness{extra}"
+        )
 
 
-def analyze_screenshot(screenshot: ScreenshotMetadata) -> ImageScore:
-    # See https://stackoverflow.com/questions/57565234/pil-not-always-using-3-channels-for-png
-    # NOTE: PIL.Image.open is a lazy evaluation. This line is needed to force to load content.
-    import brisque
-    from PIL import Image
+def file_size_score(screenshot: ScreenshotMetadata) -> float:
+    weight = scorers.weight("file_size")
+    if Config.screenshots_analysis_theoretical_fs is True:
+        return weight * (screenshot.file_size / (10.0 * 1024.0 * 1024.0))
+    return weight * (screenshot.file_size / screenshot.max_file_size)
+
+
+@contextmanager
+def scoring_context(screenshot: ScreenshotMetadata) -> Iterator["ScoringContext"]:
+    from scoring_context import ScoringContext
+
+    def context_of(frame: Optional["numpy.ndarray"]) -> ScoringContext:
+        return ScoringContext(
+            screenshot.path,
+            frame=frame,
+            brisque_max_width=Config.screenshots_brisque_max_width,
+            sharpness_max_width=Config.screenshots_sharpness_max_width,
+            grayscale=not scorers.needs_color(),
+        )
+
+    frame = screenshot.frame if screenshot.frame is not None else screenshot.decoded
+    if frame is not None or screenshot.shared_frame is None:
+        yield context_of(frame)
+        return
+
+    with screenshot.shared_frame.attach() as frame:
+        context = context_of(frame)
+        try:
+            yield context
+        finally:
+            context.release()
+
+
+def sharpness_score_of(context: "ScoringContext") -> float:
     from sharpness import DOM
 
-    image = Image.open(screenshot.path).convert("RGB")
-    image.load()
+    weight = scorers.weight("sharpness")
+    if weight == 0:
+        return 0.0
 
-    # If image is wider than 1280px resize it to
-    # (w=1280px, h=<calculated based on aspect ratio>)
-    if image.size[0] > 1280:
-        new_height = int(float(image.size[1]) * float(1280 / float(image.size[0])))
-        image = image.resize((1280, new_height), Image.Resampling.LANCZOS)
+    dom = DOM(compact=Config.screenshots_sharpness_compact, strip_height=Config.screenshots_sharpness_strip_height)
+    return weight * (dom.get_sharpness(context.sharpness_image) / SQRT2)
 
-    # 25%  file size       0 < fs < max_file_size
-    if Config.screenshots_analysis_theoretical_fs is True:
-        fs_score = 25.0 * (screenshot.file_size / (10.0 * 1024.0 * 1024.0))
-    else:
-        fs_score = 25.0 * (screenshot.file_size / screenshot.max_file_size)
 
+def quality_score_of(brisque_score: float) -> float:
     # The perfect brisque metric is 0, hence we need to
     # inverse this for meaningful scoring.
     # 55%  brisque metric  0 < min(100, score) < 100
-    brisque_metric = 100.0 - min(100.0, max(0.0, brisque.score(image)))
-    quality_score = 55.0 * (brisque_metric / 100.0)
+    brisque_metric = 100.0 - min(100.0, max(0.0, brisque_score))
+    return scorers.weight("brisque") * (brisque_metric / 100.0)
+
+
+def extra_scores_of(context: "ScoringContext") -> dict[str, float]:
+    # Scores of the profile's metrics which aren't BRISQUE, sharpness or file size
+    return {metric.name: weight * metric.compute(context) for metric, weight in scorers.extra_metrics()}
+
+
+def analyze_screenshot(screenshot: ScreenshotMetadata) -> ImageScore:
+    # 25%  file size       0 < fs < max_file_size
+    fs_score = file_size_score(screenshot)
+
+    # Decode the screenshot only once for all metrics
+    with scoring_context(screenshot) as context:
+        # Only the features are computed here, the SVR is evaluated
+        # for all screenshots at once (see score_quality)
+        brisque_features = brisque_features_of(context) if scorers.weight("brisque") > 0 else None
 
-    # 20%  sharpness       0 < score < sqrt(2)
-    sharpness_score = 20.0 * (DOM().get_sharpness(str(screenshot.path)) / SQRT2)
+        # 20%  sharpness       0 < score < sqrt(2)
+        sharpness_score = sharpness_score_of(context)
+
+        extra_scores = extra_scores_of(context)
 
     return ImageScore(
         screenshot=screenshot,
         fs_score=fs_score,
-        quality_score=quality_score,
-        sharpness_score=sharpness_score
+        quality_score=0.0,
+        sharpness_score=sharpness_score,
+        brisque_features=brisque_features,
+        extra_scores=extra_scores,
+    )
+
+
+def brisque_features_of(context: "ScoringContext") -> "numpy.ndarray":
+    import brisque
+
+    return brisque.unscaled_features(context.brisque_image, fast=Config.screenshots_brisque_fast)
+
+
+def analyze_screenshot_brisque(screenshot: ScreenshotMetadata) -> "numpy.ndarray":
+    # The expensive part of analyze_screenshot (see ScreenshotProcessor._branch_and_bound)
+    with scoring_context(screenshot) as context:
+        return brisque_features_of(context)
+
+
+def score_quality(scores: list[ImageScore]) -> None:
+    # Fills in the quality scores using one batched BRISQUE prediction
+    import brisque
+    import numpy
+
+    pending = [score for score in scores if score.brisque_features is not None]
+    if not pending:
+        return
+
+    predictions = brisque.score_batch(numpy.stack([score.brisque_features for score in pending]))
+    for score, prediction in zip(pending, predictions):
+        score.quality_score = quality_score_of(float(prediction))
+        score.brisque_features = None
+
+
+def analyze_screenshot_cheap(screenshot: ScreenshotMetadata) -> ImageScore:
+    # Used for ranking (downscaled) candidates, hence BRISQUE is skipped
+    with scoring_context(screenshot) as context:
+        sharpness_score = sharpness_score_of(context)
+        extra_scores = extra_scores_of(context)
+
+    return ImageScore(
+        screenshot=screenshot,
+        fs_score=file_size_score(screenshot),
+        quality_score=0.0,
+        sharpness_score=sharpness_score,
+        extra_scores=extra_scores,
+    )
+
+
+def thumbnails_available() -> bool:
+    # Thumbnails (see frame_filter.py) need the analysis packages (OpenCV, NumPy and
+    # Pillow), which needn't be installed if the screenshots aren't analyzed,
+    # or only scored by ffmpeg's statistics (e.g. on low-power machines)
+    return Config.screenshots_analyze and Config.screenshots_ffmpeg_stats != "score"
+
+
+def dedup_enabled() -> bool:
+    # The perceptual hashes are computed from thumbnails
+    return Config.screenshots_dedup and thumbnails_available()
+
+
+def estimate_file_size(frame: "numpy.ndarray") -> int:
+    # The size of the frame encoded by OpenCV's PNG encoder at its fastest level. Unlike DEFLATE
+    # over the raw pixels, it includes PNG's filters, which is what makes photographic content
+    # compress (often more than twice as well). It's a slight overestimate of the file Pillow
+    # writes (which uses a higher level), so frames near the 10MB limit err on the safe side.
+    import cv2
+
+    ok, encoded = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise ValueError("failed to encode a frame to PNG")
+    return len(encoded)
+
+
+def candidate_file_size(candidate: Candidate) -> int:
+    path, frame = candidate
+    return estimate_file_size(frame) if frame is not None else path.stat().st_size
+
+
+def worker_peak_rss_mb(width: int, height: int) -> float:
+    # Estimated peak RSS of a scoring process, fitted to `python benchmark.py memory`.
+    # Without the compact sharpness metric, it's dominated by the full resolution float64 buffers.
+    megapixels = width * height / 1_000_000
+    if Config.screenshots_sharpness_compact:
+        return 225.0 + 4.0 * megapixels
+    return 140.0 + 90.0 * megapixels
+
+
+def screenshot_resolution(screenshots: list[ScreenshotMetadata]) -> Optional[tuple[int, int]]:
+    from PIL import Image
+
+    for screenshot in screenshots:
+        if screenshot.frame is not None:
+            return screenshot.frame.shape[1], screenshot.frame.shape[0]
+        if screenshot.decoded is not None:
+            return screenshot.decoded.shape[1], screenshot.decoded.shape[0]
+        if screenshot.shared_frame is not None:
+            return screenshot.shared_frame.shape[1], screenshot.shared_frame.shape[0]
+        if screenshot.path.exists():
+            # Only reads the header
+            with Image.open(screenshot.path) as image:
+                return image.size
+    return None
+
+
+def _scoring_workers(n: int, threads: bool) -> str:
+    if threads:
+        return f"{n} scoring thread{'s' if n > 1 else ''}"
+    return f"{n} scoring process{'es' if n > 1 else ''}"
+
+
+def scoring_pool_size(n_screenshots: int, resolution: Optional[tuple[int, int]], threads: bool = False) -> int:
+    if Config.screenshots_scoring_processes is not None:
+        n_processes = max(1, Config.screenshots_scoring_processes)
+        print(f" --> using {_scoring_workers(n_processes, threads)} (set in the config)")
+        return n_processes
+
+    n_cpus = available_cpus()
+    # Assume the worst (2160p) if the resolution isn't known yet
+    width, height = resolution or WORST_CASE_RESOLUTION
+    rss_mb = worker_peak_rss_mb(width, height)
+    if threads:
+        # Threads share the loaded modules
+        rss_mb -= WORKER_MODULES_RSS_MB
+    available_mb = available_memory_mb()
+
+    cost_ms = scorers.cost_ms(width, height)
+    limits = {
+        # Leave a bit of processing power for the rest of the system as well
+        "CPUs": max(1, int(n_cpus * 0.85)),
+        # More processes than screenshots would just idle
+        "screenshots": max(1, n_screenshots),
+    }
+    if not threads:
+        # e.g. the fast profile scores a screenshot in a few milliseconds
+        limits["workload"] = max(1, math.ceil(n_screenshots * cost_ms / WORKER_STARTUP_MS))
+    if available_mb is not None:
+        # Leave some memory for the rest of the system (and ffmpeg) as well
+        limits["memory"] = max(1, int(available_mb * 0.8 / rss_mb))
+
+    reason = min(limits, key=lambda x: limits[x])
+    memory = f"{available_mb:.0f}MB" if available_mb is not None else "unknown"
+    print(
+        f" --> using {_scoring_workers(limits[reason], threads)}, limited by {reason} "
+        f"({n_cpus:g} CPUs, {n_screenshots} screenshots, {memory} of available memory, "
+        f"~{rss_mb:.0f}MB per {'thread' if threads else 'process'} and ~{cost_ms:.0f}ms per screenshot "
+        f"at {width}x{height})"
     )
+    return limits[reason]
+
+
+class RunningStats:
+    # Online (Welford's) mean and sample standard deviation, plus the maximum
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.max = 0
+        self._m2 = 0.0
+
+    def add(self, x: int) -> None:
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+        self.max = max(self.max, x)
+
+    def stdev(self) -> float:
+        # Same as statistics.stdev (but 0 for less than 2 values)
+        return math.sqrt(self._m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+
+def _init_worker(config: dict[str, Any], startup_times: "multiprocessing.Queue") -> None:
+    import importlib
+
+    t_start = time.perf_counter()
+
+    # Workers which weren't forked from this process start with the default config
+    for key, value in config.items():
+        setattr(Config, key, value)
+
+    for module in scorers.worker_modules():
+        importlib.import_module(module)
+
+    startup_times.put((os.getpid(), time.perf_counter() - t_start))
+
+
+class SerialPool:
+    # Runs every task in this process, one after another. Has the parts of
+    # the Pool interface which are used for scoring, so it can stand in for one.
+    def map(self, func: Callable, iterable) -> list:
+        return list(map(func, iterable))
+
+    def imap_unordered(self, func: Callable, iterable):
+        return map(func, iterable)
+
+    def close(self) -> None:
+        pass
+
+    def join(self) -> None:
+        pass
+
+
+ScoringPool = Union[Pool, SerialPool]
+SCORING_EXECUTORS = ["process", "thread", "serial"]
+
+
+class WorkerPool:
+    # Persistent pool of scoring workers, shared by every ScreenshotProcessor.
+    # Depending on Config.screenshots_scoring_executor, the workers are processes,
+    # threads of this process, or just this process' main thread (see SerialPool).
+    _pool: Optional[ScoringPool] = None
+    n_workers = 0
+    # Resolution (the largest so far) the pool was sized for
+    _resolution: Optional[tuple[int, int]] = None
+    # shutdown is registered (once) to run at exit when a pool is first started
+    _atexit_registered = False
+
+    @classmethod
+    def get(cls, n_screenshots: Optional[int] = None, resolution: Optional[tuple[int, int]] = None) -> ScoringPool:
+        # The pool is sized for the screenshots it's first started for. If it's later
+        # asked for (see ScreenshotProcessor._start_pool) larger screenshots than that,
+        # e.g. the full resolution pass after the coarse pass of the two-pass search,
+        # it's restarted if fewer workers fit into the memory.
+        if cls._pool is not None:
+            if n_screenshots is None or not cls._needs_fewer_workers(n_screenshots, resolution):
+                return cls._pool
+            cls.shutdown()
+
+        executor = Config.screenshots_scoring_executor
+        if executor not in SCORING_EXECUTORS:
+            raise ValueError(f"unknown screenshot scoring executor: {executor}")
+
+        if executor == "serial":
+            print(" --> scoring screenshots in this process, one at a time")
+            cls.n_workers = 1
+            cls._pool = SerialPool()
+            return cls._pool
+
+        if n_screenshots is None:
+            n_screenshots = Config.screenshots_n_preprocess
+        cls._resolution = resolution or WORST_CASE_RESOLUTION
+        n_processes = scoring_pool_size(n_screenshots, resolution, threads=executor == "thread")
+
+        if executor == "thread":
+            return cls._start_threads(n_processes)
+
+        start_method = Config.screenshots_pool_start_method
+        context = multiprocessing.get_context(start_method)
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload(scorers.worker_modules())
+
+        suffix = "es" if n_processes > 1 else ""
+        print(
+            f" --> starting {n_processes} visual metric scoring process{suffix} "
+            f"(start method: {context.get_start_method()})"
+        )
+
+        config = {key: getattr(Config, key) for key in Config.__annotations__}
+        startup_times = context.Queue()
+
+        # Forked workers would otherwise start resource trackers of their own, which
+        # would unlink the shared frames they've attached to once the workers exit
+        resource_tracker.ensure_running()
+
+        t_start = time.perf_counter()
+        cls.n_workers = n_processes
+        cls._pool = context.Pool(n_processes, initializer=_init_worker, initargs=(config, startup_times))
+        cls._register_shutdown()
+
+        try:
+            for _ in range(n_processes):
+                pid, elapsed = startup_times.get(timeout=120)
+                print(f"{' ':5}worker {pid} ready in {elapsed:.2f}s")
+        except queue.Empty:
+            print(f"{' ':5}timed out waiting for the workers to start")
+
+        print(f" --> worker pool ready after {time.perf_counter() - t_start:.2f}s")
+        return cls._pool
+
+    @classmethod
+    def _needs_fewer_workers(cls, n_screenshots: int, resolution: Optional[tuple[int, int]]) -> bool:
+        width, height = resolution or WORST_CASE_RESOLUTION
+        if cls._resolution is None or width * height <= cls._resolution[0] * cls._resolution[1]:
+            return False
+        if Config.screenshots_scoring_executor == "serial" or Config.screenshots_scoring_processes is not None:
+            return False
+
+        cls._resolution = (width, height)
+        print(f" --> checking the size of the scoring pool for {width}x{height} screenshots")
+        threads = Config.screenshots_scoring_executor == "thread"
+        if scoring_pool_size(n_screenshots, resolution, threads=threads) >= cls.n_workers:
+            return False
+
+        print(f" --> restarting the scoring pool, as fewer than {cls.n_workers} workers fit into the memory")
+        return True
+
+    @classmethod
+    def _start_threads(cls, n_threads: int) -> ThreadPool:
+        import importlib
+
+        # Most of the scoring (OpenCV, NumPy and SciPy) releases the GIL, so threads can score in
+        # parallel without the processes' start-up, the pickling of the frames and a model per worker
+        suffix = "s" if n_threads > 1 else ""
+        print(f" --> starting {n_threads} visual metric scoring thread{suffix}")
+
+        t_start = time.perf_counter()
+        # Load the modules (and the BRISQUE model) once, before the threads need them
+        for module in scorers.worker_modules():
+            importlib.import_module(module)
+
+        cls.n_workers = n_threads
+        cls._pool = ThreadPool(n_threads)
+        cls._register_shutdown()
+
+        print(f" --> worker pool ready after {time.perf_counter() - t_start:.2f}s")
+        return cls._pool
+
+    @classmethod
+    def _register_shutdown(cls) -> None:
+        # Pools are restarted (e.g. for larger screenshots), but one handler will do
+        if not cls._atexit_registered:
+            atexit.register(cls.shutdown)
+            cls._atexit_registered = True
+
+    @classmethod
+    def shutdown(cls) -> None:
+        if cls._pool is None:
+            return
+
+        cls._pool.close()
+        cls._pool.join()
+        cls._pool = None
+        cls._resolution = None
 
 
 class ScreenshotProcessor:
-    def __init__(self, screenshots_dir: Path):
+    # cached holds the (score cache) metrics of screenshots which weren't extracted.
+    # extract is used to extract those of them which are needed after all
+    # (to be uploaded or to run BRISQUE on them), returning their frames in raw mode.
+    # resample is used to replace screenshots rejected by the prefilter
+    # (see ScreenshotTaker.resample). stats holds the statistics ffmpeg computed
+    # while extracting the screenshots (see screenshots_ffmpeg_stats). refine is used
+    # to take screenshots around the best ones (see ScreenshotTaker.refine).
+    def __init__(
+        self,
+        screenshots_dir: Path,
+        frames: Optional[list[RawFrame]] = None,
+        prefix: str = "pre",
+        cached: Optional[dict[Path, ScreenshotMetrics]] = None,
+        extract: Optional[Callable[[list[Path]], list[RawFrame]]] = None,
+        resample: Optional[Callable[[list[Path], int], tuple[list[Path], list[RawFrame]]]] = None,
+        stats: Optional[dict[Path, FrameStats]] = None,
+        refine: Optional[Callable[[dict[Path, list[int]]], tuple[list[Path], list[RawFrame]]]] = None,
+    ):
         self.max_file_size = 0
+        self._prefix = prefix
         self.screenshots: list[ScreenshotMetadata] = []
+        # Scores of the screenshots picked for upload (if they were analyzed)
+        self.scores: list[ImageScore] = []
+        # Metrics of every analyzed screenshot (for the score cache)
+        self.metrics: dict[Path, ScreenshotMetrics] = {}
+        self._frames: list[RawFrame] = frames or []
+        self._cached: dict[Path, ScreenshotMetrics] = cached or {}
+        self._extract = extract
+        self._resample = resample
+        self._refine = refine
+        # Filled in by the taker while extracting, so it must not be copied
+        self._stats: dict[Path, FrameStats] = stats if stats is not None else {}
+        # Number of examined candidates, and how many of them every stage rejected (by reason)
+        self.n_candidates = 0
+        self.rejections: dict[str, dict[str, int]] = {}
+        # Screenshot files the prefilter decoded (handed on to the scoring, so they're decoded once)
+        self._decoded: dict[Path, "numpy.ndarray"] = {}
+        # Perceptual hashes of the candidates (if screenshots_dedup is set)
+        self._hashes: dict[Path, int] = {
+            p: m.dhash for p, m in self._cached.items() if m.dhash is not None
+        }
+        # Frames handed to the scoring processes through shared memory
+        self._shared_frames = SharedFrameStore()
 
         if screenshots_dir.is_file():
             self._input_dir = screenshots_dir.parent
@@ -82,18 +558,33 @@ class ScreenshotProcessor:
             self._input_dir = screenshots_dir
 
     def _preprocess(self) -> None:
-        pre_images: list[tuple[Path, int]] = []
+        pre_images: list[tuple[Path, int, Optional["numpy.ndarray"]]] = []
         pre_image_sizes: list[int] = []
-        for p in self._input_dir.glob("pre_*.png"):
-            sz = p.stat().st_size
+
+        candidates: list[Candidate]
+        if self._frames:
+            candidates = [(f.path, f.frame) for f in self._frames]
+        else:
+            candidates = [(p, None) for p in self._input_dir.glob(f"{self._prefix}_*.png")]
+        extracted = {p for p, _ in candidates}
+
+        inputs = [
+            (p, candidate_file_size((p, frame)), frame)
+            for p, frame in self._prefilter(candidates)
+        ]
+        self.n_candidates += sum(1 for p in self._cached if p not in extracted)
+        inputs += [(p, m.file_size, None) for p, m in self._cached.items() if p not in extracted]
+
+        for p, sz, frame in inputs:
             if sz >= TEN_MB:
                 print(f' --> image "{p.name}" is larger than 10MB. skipping...')
+                self._reject("size limit", "larger than 10MB")
                 continue
 
             if sz > self.max_file_size:
                 self.max_file_size = sz
 
-            pre_images.append((p, sz))
+            pre_images.append((p, sz, frame))
             pre_image_sizes.append(sz)
 
         if not pre_images:
@@ -101,27 +592,176 @@ class ScreenshotProcessor:
 
         print(f"pre-processing {len(pre_images)} screenshots")
 
-        img_mean = statistics.mean(pre_image_sizes)
-        cut_off = statistics.stdev(pre_image_sizes) * 1.25
+        for p, sz, _ in pre_images:
+            self.metrics[p] = ScreenshotMetrics(file_size=sz, dhash=self._hashes.get(p))
+
+        self.screenshots = self._deduplicate(self._prune_outliers(
+            [
+                ScreenshotMetadata(
+                    path=p, file_size=sz, max_file_size=self.max_file_size, frame=frame,
+                    decoded=self._decoded.pop(p, None),
+                )
+                for p, sz, frame in pre_images
+            ],
+            img_mean=statistics.mean(pre_image_sizes),
+            img_stdev=statistics.stdev(pre_image_sizes) if len(pre_image_sizes) > 1 else 0.0,
+        ))
+        self._decoded.clear()
+        self._report_rejections()
+
+    def _reject(self, stage: str, reason: str) -> None:
+        reasons = self.rejections.setdefault(stage, {})
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def _report_rejections(self) -> None:
+        n_rejected = sum(sum(reasons.values()) for reasons in self.rejections.values())
+        print(f" --> rejected {n_rejected} of {self.n_candidates} candidates")
+        for stage, reasons in self.rejections.items():
+            details = ", ".join(f"{n} {reason}" for reason, n in reasons.items())
+            print(f"{' ':5}{stage}: {sum(reasons.values())} ({details})")
+
+    def _filter_degenerate(self, candidates: list[Candidate]) -> tuple[list[Candidate], list[Candidate]]:
+        # Splits the candidates into the kept and the rejected ones (see frame_filter,
+        # or ffmpeg_stats if ffmpeg computed the statistics of the screenshots).
+        # The thumbnails are hashed for the deduplication along the way.
+        self.n_candidates += len(candidates)
+        check_thumbnails = Config.screenshots_prefilter and thumbnails_available()
+        dedup = dedup_enabled()
+        if not (check_thumbnails or Config.screenshots_ffmpeg_stats or dedup) or not candidates:
+            return candidates, []
+
+        def reason_of(candidate: Candidate) -> Optional[str]:
+            path, frame = candidate
+            stats = self._stats.get(path)
+
+            gray = None
+            if dedup or (check_thumbnails and stats is None):
+                if frame is None:
+                    from scoring_context import decode_image
+
+                    # Kept, so the file doesn't need to be decoded again for scoring
+                    frame = self._decoded[path] = decode_image(path)
+                gray = thumbnail(frame)
+            if gray is not None and dedup:
+                self._hashes[path] = dhash(gray)
+
+            if stats is not None:
+                return ffmpeg_stats.rejection_reason(stats)
+            if gray is None or not check_thumbnails:
+                return None
+            return rejection_reason(gray)
+
+        # Decoding (PIL), resizing (OpenCV) and NumPy all release the GIL
+        with ThreadPoolExecutor(max_workers=max(1, int(available_cpus()))) as executor:
+            reasons = list(executor.map(reason_of, candidates))
+
+        kept, rejected = [], []
+        for candidate, reason in zip(candidates, reasons):
+            if reason is None:
+                kept.append(candidate)
+            else:
+                self._reject("prefilter", reason)
+                self._decoded.pop(candidate[0], None)
+                rejected.append(candidate)
+        return kept, rejected
+
+    def _resample_rejected(self, rejected: list[Candidate], attempt: int) -> list[Candidate]:
+        suffix = "s" if len(rejected) > 1 else ""
+        print(
+            f" --> re-sampling {len(rejected)} rejected screenshot{suffix} at nearby timestamps "
+            f"(attempt {attempt} of {Config.screenshots_prefilter_resamples})"
+        )
+        paths, frames = self._resample([p for p, _ in rejected], attempt)
+        return [(f.path, f.frame) for f in frames] + [(p, None) for p in paths]
+
+    def _prefilter(self, candidates: list[Candidate]) -> list[Candidate]:
+        # Rejects black, flat, credits, ... frames before they're scored or skew the
+        # file size statistics, and replaces them by ones from nearby timestamps
+        kept, rejected = self._filter_degenerate(candidates)
+        all_rejected = list(rejected)
+        for attempt in range(1, Config.screenshots_prefilter_resamples + 1):
+            if not rejected or self._resample is None:
+                break
+
+            replaced, rejected = self._filter_degenerate(self._resample_rejected(rejected, attempt))
+            kept += replaced
+            all_rejected += rejected
+
+        return kept + self._fall_back(len(kept), all_rejected)
+
+    @staticmethod
+    def _fall_back(n_kept: int, rejected: list[Candidate]) -> list[Candidate]:
+        # The largest of the rejected candidates, if too few were kept to go on with. The
+        # checks can reject (almost) everything, e.g. a dark film whose night scenes
+        # are rejected as black, in which case the re-samples are likely rejected as well.
+        n_missing = min(len(rejected), max(2, Config.screenshots_n_upload) - n_kept)
+        if n_missing <= 0:
+            return []
+
+        suffix = "s" if n_missing > 1 else ""
+        print(
+            f" --> only {n_kept} candidates passed the prefilter, "
+            f"keeping the {n_missing} largest rejected one{suffix} after all"
+        )
+        return heapq.nlargest(n_missing, rejected, key=candidate_file_size)
+
+    def _near_duplicate(self, path: Path, kept_hashes: list[int]) -> bool:
+        # Whether the screenshot is near-identical to one of the kept ones. If it
+        # isn't (and it was hashed), its hash gets added to the kept ones.
+        hash_ = self._hashes.get(path)
+        if hash_ is None:
+            return False
+
+        if find_near_duplicate(hash_, kept_hashes, Config.screenshots_dedup_max_distance) is not None:
+            return True
+
+        kept_hashes.append(hash_)
+        return False
+
+    def _deduplicate(self, screenshots: list[ScreenshotMetadata]) -> list[ScreenshotMetadata]:
+        # Groups near-identical screenshots (e.g. of the same static shot) and keeps only
+        # one of every group, the largest file (i.e. the one with the most detail)
+        if not dedup_enabled():
+            return screenshots
+
+        kept_hashes: list[int] = []
+        duplicates: set[Path] = set()
+        for screenshot in sorted(screenshots, key=lambda x: -x.file_size):
+            if self._near_duplicate(screenshot.path, kept_hashes):
+                self._reject("deduplication", "near-identical")
+                duplicates.add(screenshot.path)
+
+        if duplicates:
+            suffix = "s" if len(duplicates) > 1 else ""
+            print(f" --> removed {len(duplicates)} near-duplicate screenshot{suffix}")
+        return [x for x in screenshots if x.path not in duplicates]
+
+    def _prune_outliers(
+        self, screenshots: list[ScreenshotMetadata], img_mean: float, img_stdev: float
+    ) -> list[ScreenshotMetadata]:
+        cut_off = img_stdev * 1.25
 
         lower, upper = img_mean - cut_off, img_mean + cut_off
 
         n_lower_removals, n_upper_removals = 0, 0
         n_outlier_prunes = Config.screenshots_n_outlier_prunes
+        if Config.screenshots_candidates == "packet_size":
+            # Outliers were already pruned by their keyframe packet sizes
+            n_outlier_prunes = 0
+
+        kept: list[ScreenshotMetadata] = []
 
         # Sort according to size, so we remove top-n/top-m outliers first
-        pre_images = sorted(pre_images, key=lambda x: -x[1])
-        for p, sz in pre_images:
+        for screenshot in sorted(screenshots, key=lambda x: -x.file_size):
+            sz = screenshot.file_size
             if sz < lower and n_lower_removals < n_outlier_prunes:
                 n_lower_removals += 1
+                self._reject("outliers", "lower bound")
             elif sz > upper and n_upper_removals < n_outlier_prunes:
                 n_upper_removals += 1
+                self._reject("outliers", "upper bound")
             else:
-                self.screenshots.append(
-                    ScreenshotMetadata(
-                        path=p, file_size=sz, max_file_size=self.max_file_size
-                    )
-                )
+                kept.append(screenshot)
 
         if n_lower_removals > 0:
             suffix = "s" if n_lower_removals > 1 else ""
@@ -131,6 +771,199 @@ class ScreenshotProcessor:
             suffix = "s" if n_upper_removals > 1 else ""
             print(f" --> removed {n_upper_removals} upper bound outlier{suffix}")
 
+        return kept
+
+    @staticmethod
+    def _map(func, screenshots: list[ScreenshotMetadata]) -> list:
+        return WorkerPool.get().map(func, screenshots)
+
+    def _start_pool(self) -> None:
+        # Size the pool for all screenshots of this processor (if it's not running yet)
+        WorkerPool.get(len(self.screenshots), screenshot_resolution(self.screenshots))
+        self._share_frames(self.screenshots)
+
+    def _share_frames(self, screenshots: list[ScreenshotMetadata]) -> None:
+        # Puts the decoded frames into shared memory, which the scoring processes map instead of
+        # getting the (pickled) raw frames or decoding the screenshot files on every pass.
+        # Threads don't need this, as they share this process' memory anyway.
+        if not Config.screenshots_shared_memory or Config.screenshots_scoring_executor != "process":
+            return
+
+        pending = [
+            x for x in screenshots
+            if x.shared_frame is None and (x.frame is not None or x.decoded is not None or x.path.exists())
+        ]
+        resolution = screenshot_resolution(pending)
+        if resolution is None:
+            return
+
+        # Keep some shared memory for others (frames which don't fit are sent as before)
+        available_mb = available_shared_memory_mb()
+        if available_mb is not None:
+            frame_mb = resolution[0] * resolution[1] * 3 / 1024 / 1024
+            n_fitting = max(0, int(available_mb * 0.8 / frame_mb))
+            if n_fitting < len(pending):
+                print(f" --> only {n_fitting} of {len(pending)} frames fit into the free shared memory")
+                pending = pending[:n_fitting]
+
+        def share(screenshot: ScreenshotMetadata) -> None:
+            if screenshot.frame is not None:
+                screenshot.shared_frame = self._shared_frames.put(screenshot.frame)
+            elif screenshot.decoded is not None:
+                screenshot.shared_frame = self._shared_frames.put(screenshot.decoded)
+                screenshot.decoded = None
+            else:
+                screenshot.shared_frame = self._shared_frames.decode(screenshot.path)
+
+        t_start = time.perf_counter()
+        # Decoding (PIL) and copying (NumPy) both release the GIL
+        with ThreadPoolExecutor(max_workers=max(1, int(available_cpus()))) as executor:
+            list(executor.map(share, pending))
+
+        if pending:
+            suffix = "s" if len(pending) > 1 else ""
+            print(
+                f" --> moved {len(pending)} frame{suffix} to shared memory in {time.perf_counter() - t_start:.2f}s "
+                f"({self._shared_frames.nbytes / 1024 / 1024:.0f}MB in use)"
+            )
+
+    def _release_frames(self) -> None:
+        # The screenshots keep their handles, but they must not be scored anymore
+        self._shared_frames.release()
+        self._decoded.clear()
+        for screenshot in self.screenshots:
+            screenshot.decoded = None
+
+    def _ensure_extracted(self, screenshots: list[ScreenshotMetadata]) -> None:
+        # Extracts the screenshots which were skipped, because they were in the score cache
+        missing = [
+            x for x in screenshots if x.frame is None and x.shared_frame is None and not x.path.exists()
+        ]
+        if not missing:
+            return
+
+        if self._extract is None:
+            raise RuntimeError("cached screenshots can't be extracted")
+
+        suffix = "s" if len(missing) > 1 else ""
+        print(f" --> extracting {len(missing)} cached screenshot{suffix}")
+        frames = {f.path: f.frame for f in self._extract([x.path for x in missing])}
+        for screenshot in missing:
+            screenshot.frame = frames.get(screenshot.path)
+        self._share_frames(missing)
+
+    def _record(self, score: ImageScore, has_quality: bool) -> None:
+        self.metrics[score.screenshot.path] = ScreenshotMetrics(
+            file_size=score.screenshot.file_size,
+            sharpness_score=score.sharpness_score,
+            quality_score=score.quality_score if has_quality else None,
+            dhash=self._hashes.get(score.screenshot.path),
+        )
+
+    def _cached_sharpness(self, screenshot: ScreenshotMetadata) -> Optional[float]:
+        cached = self._cached.get(screenshot.path)
+        return cached.sharpness_score if cached is not None else None
+
+    def _score_cheap(self, screenshots: list[ScreenshotMetadata]) -> list[ImageScore]:
+        # File size and sharpness scores (the quality score is left at 0)
+        missing = [x for x in screenshots if self._cached_sharpness(x) is None]
+        self._ensure_extracted(missing)
+
+        scores = self._map(analyze_screenshot_cheap, missing)
+        scores += [
+            ImageScore(
+                screenshot=x,
+                fs_score=file_size_score(x),
+                quality_score=0.0,
+                sharpness_score=self._cached_sharpness(x),
+            )
+            for x in screenshots if self._cached_sharpness(x) is not None
+        ]
+
+        for score in scores:
+            self._record(score, has_quality=False)
+        return scores
+
+    def _score_quality(self, scores: list[ImageScore]) -> None:
+        # Fills in the quality scores of cheaply scored screenshots (unless they're cached)
+        missing: list[ImageScore] = []
+        for score in scores:
+            cached = self._cached.get(score.screenshot.path)
+            if cached is not None and cached.quality_score is not None:
+                score.quality_score = cached.quality_score
+            else:
+                missing.append(score)
+
+        if missing:
+            self._ensure_extracted([x.screenshot for x in missing])
+            for score, features in zip(missing, self._map(analyze_screenshot_brisque, [x.screenshot for x in missing])):
+                score.brisque_features = features
+            score_quality(missing)
+
+        for score in scores:
+            self._record(score, has_quality=True)
+
+    def _branch_and_bound(self) -> list[ImageScore]:
+        # Scores the cheap metrics (file size and sharpness) of every screenshot first.
+        # BRISQUE is then run (in rounds of one screenshot per process) in descending order
+        # of the best total score a screenshot could reach, i.e. with a perfect BRISQUE score,
+        # until no remaining screenshot can beat the current K-th best total score.
+        top_k = Config.screenshots_n_upload
+        # Quality score of a perfect BRISQUE metric
+        max_quality_score = scorers.weight("brisque")
+
+        candidates = sorted(self._score_cheap(self.screenshots), key=lambda x: -x.total_score())
+
+        # Min-heap of the best (total score, index, score) tuples
+        best: list[tuple[float, int, ImageScore]] = []
+
+        n_round = max(1, WorkerPool.n_workers)
+        n_analyzed = 0
+        while n_analyzed < len(candidates):
+            kth_score = best[0][0] if len(best) >= top_k else -math.inf
+
+            batch = [
+                score for score in candidates[n_analyzed:n_analyzed + n_round]
+                if score.total_score() + max_quality_score >= kth_score
+            ]
+            if not batch:
+                # Candidates are sorted by their upper bound, hence none of the remaining can make it
+                break
+
+            # The batch is a prefix of the remaining candidates (for the same reason)
+            n_analyzed += len(batch)
+
+            self._score_quality(batch)
+
+            for i, score in enumerate(batch, start=n_analyzed - len(batch)):
+                entry = (score.total_score(), -i, score)
+                if len(best) < top_k:
+                    heapq.heappush(best, entry)
+                else:
+                    heapq.heappushpop(best, entry)
+
+        n_skipped = len(candidates) - n_analyzed
+        print(
+            f" --> ran BRISQUE on {n_analyzed} of {len(candidates)} screenshots "
+            f"({n_skipped} calls saved, as they couldn't make it into the top-{top_k})"
+        )
+        return [score for _, _, score in best]
+
+    def rank(self, n: int) -> list[ScreenshotMetadata]:
+        # Cheaply rank the screenshots by file size and sharpness and return the best n
+        self._preprocess()
+
+        print(f"ranking {len(self.screenshots)} screenshots by file size and sharpness")
+        try:
+            self._start_pool()
+            scores = self._map(analyze_screenshot_cheap, self.screenshots)
+        finally:
+            self._release_frames()
+
+        # Sort in DESC ordering
+        scores = sorted(scores, key=lambda x: -x.total_score())
+        return [score.screenshot for score in scores[:n]]
+
     def process(self) -> None:
         self._preprocess()
 
@@ -142,24 +975,355 @@ class ScreenshotProcessor:
             for i, screenshot in enumerate(self.screenshots):
                 print(f"{' ':2}#{i + 1:02}: {screenshot.path.name}")
 
+            self._write_frames()
             return
 
-        # Leave a bit of processing power for the rest of the system as well
-        n_cpu_count = max(2, int(cpu_count() * 0.85))
-        print(f" --> parallelizing visual metric scoring to {n_cpu_count} processes")
+        if Config.screenshots_ffmpeg_stats == "score":
+            self._select(self._score_ffmpeg_stats())
+            return
+
+        try:
+            self._start_pool()
+            if Config.screenshots_branch_and_bound and scorers.weight("brisque") > 0:
+                scores = self._branch_and_bound()
+            else:
+                uncached = [x for x in self.screenshots if self._cached_sharpness(x) is None]
+                self._ensure_extracted(uncached)
+
+                scores = self._map(analyze_screenshot, uncached)
+                score_quality(scores)
+                for score in scores:
+                    self._record(score, has_quality=True)
+
+                cached_scores = self._score_cheap(
+                    [x for x in self.screenshots if self._cached_sharpness(x) is not None]
+                )
+                self._score_quality(cached_scores)
+                scores += cached_scores
+
+            print(f" --> finished analyzing data")
+            self._select(self._refine_best(scores))
+        finally:
+            self._release_frames()
+
+    def _refine_best(self, scores: list[ImageScore]) -> list[ImageScore]:
+        # Local search: takes a few more screenshots around the timestamps of the top-K ones
+        # and scores them, halving the window every round. Stops once the top-K doesn't change
+        # anymore (i.e. all of them were refined around), or the time or CPU budget runs out.
+        if not Config.screenshots_refine or self._refine is None or not scores:
+            return scores
+
+        top_k = Config.screenshots_n_upload
+        window = Config.screenshots_refine_window
+        time_budget = Config.screenshots_refine_time_budget
+        cpu_budget = Config.screenshots_refine_cpu_budget
+        refined: set[Path] = set()
+
+        t_start = time.perf_counter()
+        cpu_start = time.process_time() + children_cpu_seconds()
+        # Busy time of the scoring processes, whose CPU time can't be measured from here
+        workers_cpu = 0.0
+        last_round: Optional[tuple[float, float]] = None
+
+        n_round = 0
+        while window >= MIN_REFINE_WINDOW:
+            elapsed = time.perf_counter() - t_start
+            cpu_elapsed = time.process_time() + children_cpu_seconds() - cpu_start + workers_cpu
+            # Only start a round which is expected to fit into the remaining budget
+            round_time, round_cpu = last_round or (0.0, 0.0)
+            if time_budget is not None and elapsed + round_time > time_budget:
+                print(f" --> refinement stopped: time budget of {time_budget:g}s used up")
+                break
+            if cpu_budget is not None and cpu_elapsed + round_cpu > cpu_budget:
+                print(f" --> refinement stopped: CPU budget of {cpu_budget:g} CPU-seconds used up")
+                break
+
+            ranked = self._distinct(sorted(scores, key=lambda x: -x.total_score()), top_k, verbose=False)
+            seeds = [score for score in ranked if score.screenshot.path not in refined]
+            if not seeds:
+                break
+
+            n_round += 1
+            t_round = time.perf_counter()
+            cpu_round = time.process_time() + children_cpu_seconds() + workers_cpu
+
+            n_steps = max(1, math.ceil(Config.screenshots_refine_n_frames / 2))
+            offsets = [
+                sign * int(window * 1000 * i / n_steps) for i in range(1, n_steps + 1) for sign in (1, -1)
+            ][:Config.screenshots_refine_n_frames]
+            refined.update(score.screenshot.path for score in seeds)
+
+            paths, frames = self._refine({score.screenshot.path: offsets for score in seeds})
+            kept, _ = self._filter_degenerate([(f.path, f.frame) for f in frames] + [(p, None) for p in paths])
+
+            screenshots: list[ScreenshotMetadata] = []
+            for p, frame in kept:
+                sz = candidate_file_size((p, frame))
+                if sz >= TEN_MB:
+                    self._reject("size limit", "larger than 10MB")
+                    continue
+                self.max_file_size = max(self.max_file_size, sz)
+                screenshots.append(ScreenshotMetadata(
+                    path=p, file_size=sz, max_file_size=self.max_file_size, frame=frame,
+                    decoded=self._decoded.pop(p, None),
+                ))
+
+            best_before = max(score.total_score() for score in scores)
+            if screenshots:
+                # The file size scores are relative to the largest screenshot so far
+                for score in scores:
+                    score.screenshot.max_file_size = self.max_file_size
+                    score.fs_score = file_size_score(score.screenshot)
+                for screenshot in screenshots:
+                    screenshot.max_file_size = self.max_file_size
+
+                self._share_frames(screenshots)
+                t_scoring = time.perf_counter()
+                round_scores = self._map(analyze_screenshot, screenshots)
+                if Config.screenshots_scoring_executor == "process":
+                    workers_cpu += (time.perf_counter() - t_scoring) * min(WorkerPool.n_workers, len(screenshots))
+                score_quality(round_scores)
+
+                for score in round_scores:
+                    self._record(score, has_quality=True)
+                scores = scores + round_scores
+
+            last_round = (
+                time.perf_counter() - t_round,
+                time.process_time() + children_cpu_seconds() + workers_cpu - cpu_round,
+            )
+            print(
+                f" --> refinement round {n_round}: scored {len(screenshots)} screenshots within "
+                f"±{window:g}s of {len(seeds)} timestamps in {last_round[0]:.2f}s "
+                f"(best score {best_before:.02f} -> {max(score.total_score() for score in scores):.02f} points)"
+            )
+            window /= 2
+
+        return scores
+
+    def _score_ffmpeg_stats(self) -> list[ImageScore]:
+        # Scores the screenshots using the statistics computed by ffmpeg instead of BRISQUE
+        # and the DOM sharpness metric, which takes no time at all (but is way less accurate)
+        print(f"scoring {len(self.screenshots)} screenshots using ffmpeg's statistics")
+
+        scores: list[ImageScore] = []
+        n_missing = 0
+        for screenshot in self.screenshots:
+            stats = self._stats.get(screenshot.path)
+            if stats is None:
+                # e.g. taken from the score cache, or ffmpeg lacks the filters
+                n_missing += 1
+            scores.append(ImageScore(
+                screenshot=screenshot,
+                fs_score=file_size_score(screenshot),
+                quality_score=ffmpeg_stats.quality_score(stats) if stats is not None else 0.0,
+                sharpness_score=ffmpeg_stats.sharpness_score(stats) if stats is not None else 0.0,
+            ))
+
+        if n_missing:
+            print(f" --> no statistics for {n_missing} screenshot{'s' if n_missing > 1 else ''}, scored by file size only")
+        return scores
+
+    def process_streaming(self, extract: Callable[[ExtractedCallback], None]) -> None:
+        # Same as process, but screenshots get scored while they're still being extracted.
+        #
+        # extract runs the extraction and must call the given callback for every batch of
+        # extracted screenshots. It runs in its own thread, while this one collects the scores.
+        try:
+            self._process_streaming(extract)
+        finally:
+            self._release_frames()
+
+    def _process_streaming(self, extract: Callable[[ExtractedCallback], None]) -> None:
+        stats = RunningStats()
+        pending: queue.Queue[Optional[ScreenshotMetadata]] = queue.Queue()
+        timings: dict[str, float] = {}
+        errors: list[BaseException] = []
+        # Candidates rejected by the prefilter, which haven't been re-sampled yet
+        rejected: list[Candidate] = []
+        all_rejected: list[Candidate] = []
+        # Hashes of the screenshots passed on for scoring. Unlike in batch mode, the
+        # first of a group of near-identical screenshots is kept (it may already be scored).
+        kept_hashes: list[int] = []
+
+        def add_candidates(candidates: list[Candidate], prefilter: bool = True) -> None:
+            kept, newly_rejected = self._filter_degenerate(candidates) if prefilter else (candidates, [])
+            rejected.extend(newly_rejected)
+            all_rejected.extend(newly_rejected)
+
+            batch: list[ScreenshotMetadata] = []
+            for p, frame in kept:
+                sz = candidate_file_size((p, frame))
+                if sz >= TEN_MB:
+                    print(f' --> image "{p.name}" is larger than 10MB. skipping...')
+                    self._reject("size limit", "larger than 10MB")
+                    continue
+                if self._near_duplicate(p, kept_hashes):
+                    self._reject("deduplication", "near-identical")
+                    continue
+
+                timings.setdefault("scoring_start", time.perf_counter())
+                stats.add(sz)
+                batch.append(ScreenshotMetadata(
+                    path=p, file_size=sz, max_file_size=stats.max, frame=frame, decoded=self._decoded.pop(p, None)
+                ))
+
+            # Every screenshot is scored only once here, so only frames which are decoded
+            # already (and would be pickled otherwise) are worth putting into shared memory
+            self._share_frames([x for x in batch if x.frame is not None or x.decoded is not None])
+            for screenshot in batch:
+                pending.put(screenshot)
 
-        pool = Pool(n_cpu_count)
-        scores = pool.map(analyze_screenshot, self.screenshots)
+        def on_extracted(paths: list[Path], frames: list[RawFrame]) -> None:
+            add_candidates([(f.path, f.frame) for f in frames] + [(p, None) for p in paths])
 
-        print(f" --> finished analyzing data")
+        def run_extraction() -> None:
+            timings["extraction_start"] = time.perf_counter()
+            try:
+                extract(on_extracted)
+
+                # Replace the rejected screenshots once the planned ones are extracted
+                for attempt in range(1, Config.screenshots_prefilter_resamples + 1):
+                    if not rejected or self._resample is None:
+                        break
+
+                    replacements = self._resample_rejected(list(rejected), attempt)
+                    rejected.clear()
+                    add_candidates(replacements)
+
+                add_candidates(self._fall_back(stats.n, all_rejected), prefilter=False)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                timings["extraction_end"] = time.perf_counter()
+                pending.put(None)
+
+        # Start the workers before the extraction, so they're ready for the first screenshot
+        # (the resolution isn't known yet, e.g. after the coarse pass of the two-pass search)
+        pool = WorkerPool.get(Config.screenshots_n_preprocess)
+
+        print("scoring screenshots as soon as they're extracted")
+        extraction = threading.Thread(target=run_extraction, name="screenshot-extraction")
+        extraction.start()
+
+        top_k = Config.screenshots_n_upload
+        scores: list[ImageScore] = []
+        try:
+            for score in pool.imap_unordered(analyze_screenshot, iter(pending.get, None)):
+                score_quality([score])
+                scores.append(score)
+
+                # The file size scores are relative to the largest screenshot so far
+                for s in scores:
+                    s.screenshot.max_file_size = stats.max
+                    s.fs_score = file_size_score(s.screenshot)
+
+                leaders = heapq.nlargest(top_k, scores, key=lambda x: x.total_score())
+                print(
+                    f" --> scored {score.screenshot.path.name}: {score.total_score():.02f} points "
+                    f"(running top-{top_k}: {', '.join(x.screenshot.path.name for x in leaders)})"
+                )
+            timings["scoring_end"] = time.perf_counter()
+        finally:
+            extraction.join()
+
+        if errors:
+            raise errors[0]
+
+        if not scores:
+            raise ValueError("no screenshots found for processing")
+
+        t_start, t_end = timings["extraction_start"], timings["extraction_end"]
+        t_scoring_start, t_scoring_end = timings["scoring_start"], timings["scoring_end"]
+        overlap = max(0.0, min(t_end, t_scoring_end) - max(t_start, t_scoring_start))
+        print(
+            f" --> finished analyzing data: extraction took {t_end - t_start:.2f}s, "
+            f"scoring {t_scoring_end - t_scoring_start:.2f}s, overlapping for {overlap:.2f}s "
+            f"(done {t_scoring_end - t_end:.2f}s after the extraction)"
+        )
+
+        # Outliers can only be known once every file size has been seen
+        self.max_file_size = stats.max
+        kept = self._prune_outliers(
+            [score.screenshot for score in scores], img_mean=stats.mean, img_stdev=stats.stdev()
+        )
+        kept_paths = {screenshot.path for screenshot in kept}
+        self._report_rejections()
+        self._select([score for score in scores if score.screenshot.path in kept_paths])
+
+    def _select(self, scores: list[ImageScore]) -> None:
+        top_k = Config.screenshots_n_upload
         print(f"top-{top_k} screenshot results (to be uploaded):")
 
         self.screenshots = []
 
         # Sort in DESC ordering
         scores = sorted(scores, key=lambda x: -x.total_score())
-        for i, score in enumerate(scores[:top_k]):
+        for i, score in enumerate(self._distinct(scores, top_k)):
             print(f"{' ':2}#{i + 1:02}: {score.screenshot.path.name}: {score.total_score():.02f} points")
             print(f"{' ':7}{score}")
 
             self.screenshots.append(score.screenshot)
+            self.scores.append(score)
+
+        self._ensure_extracted(self.screenshots)
+        self._write_frames()
+
+    def _distinct(self, scores: list[ImageScore], n: int, verbose: bool = True) -> list[ImageScore]:
+        # The first n of the (sorted) scores, skipping near-duplicates of better ones.
+        # Only screenshots from score caches written before hashes were cached
+        # (and the ones taken by _refine_best) haven't been deduplicated already.
+        if not dedup_enabled():
+            return scores[:n]
+
+        picked: list[ImageScore] = []
+        kept_hashes: list[int] = []
+        for score in scores:
+            if len(picked) == n:
+                break
+
+            screenshot = score.screenshot
+            if screenshot.path not in self._hashes:
+                self._ensure_extracted([screenshot])
+                self._hashes[screenshot.path] = dhash(self._thumbnail_of(screenshot))
+                if screenshot.path in self.metrics:
+                    self.metrics[screenshot.path].dhash = self._hashes[screenshot.path]
+
+            if self._near_duplicate(screenshot.path, kept_hashes):
+                if verbose:
+                    print(f" --> skipping {screenshot.path.name}, as it's near-identical to a better screenshot")
+                continue
+            picked.append(score)
+        return picked
+
+    @staticmethod
+    def _thumbnail_of(screenshot: ScreenshotMetadata) -> "numpy.ndarray":
+        if screenshot.frame is not None:
+            return thumbnail(screenshot.frame)
+        if screenshot.decoded is not None:
+            return thumbnail(screenshot.decoded)
+        if screenshot.shared_frame is not None and not screenshot.path.exists():
+            with screenshot.shared_frame.attach() as frame:
+                return thumbnail(frame)
+        return thumbnail_of_file(screenshot.path)
+
+    @staticmethod
+    def _encode(frame: "numpy.ndarray", path: Path) -> None:
+        # Only raw frames need Pillow, screenshot files are already encoded
+        from PIL import Image
+
+        Image.fromarray(frame).save(path, format="PNG")
+
+    def _write_frames(self) -> None:
+        # Only the screenshots picked for upload get encoded to PNG
+        for screenshot in self.screenshots:
+            if screenshot.frame is not None:
+                self._encode(screenshot.frame, screenshot.path)
+            elif screenshot.shared_frame is not None and not screenshot.path.exists():
+                # A raw frame, scored by another process (which doesn't send it back)
+                with screenshot.shared_frame.attach() as frame:
+                    self._encode(frame, screenshot.path)
+            else:
+                continue
+
+            screenshot.file_size = screenshot.path.stat().st_size
@@ -1,11 +1,40 @@
 import os
+import re
+import math
+import time
+import statistics
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional, TYPE_CHECKING
 
 from config import Config
 from dir_metadata import DirMetadata
 from file_metadata import FileMetadata
+from ffmpeg_stats import FrameStats, read_stats, stats_filter
+from keyframe_index import KeyframeIndex
+
+if TYPE_CHECKING:
+    import numpy
+
+
+try:
+    import resource
+except ImportError:  # e.g. Windows
+    resource = None
+
+# Height (in pixels) to which frames get downscaled for scene change detection
+SCENE_DETECTION_HEIGHT = 180
+
+
+def children_cpu_seconds() -> float:
+    # CPU time consumed by (finished) child processes, e.g. ffmpeg
+    if resource is None:
+        return 0.0
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
 
 
 def ms_to_hhmmss(msec: float) -> str:
@@ -16,6 +45,20 @@ def ms_to_hhmmss(msec: float) -> str:
     return f"{hours:02}:{minutes:02}:{seconds:02}"
 
 
+@dataclass
+class RawFrame:
+    # where the frame gets written to, if it's picked for upload
+    path: Path
+    # note: the timestamp is in miliseconds
+    msec: int
+    # decoded RGB frame of shape (height, width, 3)
+    frame: "numpy.ndarray"
+
+
+# Receives the screenshot files (PNG modes) or frames (raw mode) of a finished ffmpeg job
+ExtractedCallback = Callable[[list[Path], list[RawFrame]], None]
+
+
 class ScreenshotTaker:
     def __init__(
         self,
@@ -30,6 +73,16 @@ class ScreenshotTaker:
             )
 
         self.created_image_files: list[Path] = []
+        # Only used if screenshots_ffmpeg_raw_frames is set to True
+        self.frames: list[RawFrame] = []
+        # The source file and timestamp of every screenshot
+        self.timestamps: dict[Path, tuple[FileMetadata, int]] = {}
+        # CPU time spent in ffmpeg (if it can be measured)
+        self.cpu_seconds = 0.0
+        # Statistics ffmpeg computed for every screenshot (if screenshots_ffmpeg_stats is set)
+        self.ffmpeg_stats: dict[Path, FrameStats] = {}
+        # Number of screenshots taken by refine
+        self._n_refined = 0
 
         self.file_metadata = file_metadata
         self.dir_metadata = dir_metadata
@@ -56,16 +109,175 @@ class ScreenshotTaker:
         if not found:
             raise RuntimeError("failed to find a suitable screenshot directory")
 
-    def generate(self):
+    def generate(self, on_extracted: Optional[ExtractedCallback] = None):
         self.screenshots_dir.mkdir(exist_ok=True)
+        self._extract(self._plan(Config.screenshots_n_preprocess, prefix="pre"), on_extracted=on_extracted)
 
-        n_screenshots = Config.screenshots_n_preprocess
-        if self.is_single_file:
-            self._generate_screenshots(
-                file=self.file_metadata,
-                it_from=0,
-                it_to=n_screenshots
+    def plan(self) -> list[Path]:
+        # Picks the screenshots generate would take, without extracting them
+        self.screenshots_dir.mkdir(exist_ok=True)
+        plans = self._plan(Config.screenshots_n_preprocess, prefix="pre")
+        return [output_file for _, timestamps in plans for _, output_file in timestamps]
+
+    def extract(self, paths: list[Path]) -> list[RawFrame]:
+        # Extracts previously planned screenshots (returns their frames in raw mode)
+        plans: list[tuple[FileMetadata, list[tuple[int, Path]]]] = []
+        for file in self._files():
+            timestamps = sorted(
+                (self.timestamps[path][1], path) for path in paths if self.timestamps[path][0] is file
             )
+            if timestamps:
+                plans.append((file, timestamps))
+
+        self._extract(plans)
+        return self.frames
+
+    def resample(self, paths: list[Path], attempt: int) -> tuple[list[Path], list[RawFrame]]:
+        # Extracts replacements for the given screenshots at nearby timestamps. Relative to the
+        # original timestamp, attempt 1 is screenshots_prefilter_resample_offset later,
+        # attempt 2 as much earlier, attempt 3 twice as much later, and so on (given that
+        # every attempt replaces the screenshots of the previous one).
+        # Like refine, timestamps stay within the considered duration and are snapped to keyframes
+        # if only keyframes get decoded (so the recorded timestamps are the ones of the frames).
+        offset = int(Config.screenshots_prefilter_resample_offset * 1000) * attempt
+        if attempt % 2 == 0:
+            offset = -offset
+        keyframes_only = Config.screenshots_keyframe_seek or Config.screenshots_candidates == "packet_size"
+
+        plans: list[tuple[FileMetadata, list[tuple[int, Path]]]] = []
+        for file in self._files():
+            duration = int(file.duration / 2 if Config.screenshots_no_spoilers else file.duration)
+            taken = {msec for source, msec in self.timestamps.values() if source is file}
+
+            timestamps: list[tuple[int, Path]] = []
+            for path in paths:
+                source, msec = self.timestamps[path]
+                resampled = min(max(0, msec + offset), max(0, duration - 1))
+                if source is not file or resampled == msec:
+                    continue
+
+                name = f"{path.stem.split('_r')[0]}_r{attempt}.png"
+                timestamps.append((resampled, self._output_file(file, resampled, name)))
+
+            if timestamps and keyframes_only:
+                # A re-sample snapped to a keyframe which was taken already would be the same frame
+                snapped: list[tuple[int, Path]] = []
+                for msec, output_file in self._snap_to_keyframes(file, timestamps, duration):
+                    if msec in taken:
+                        del self.timestamps[output_file]
+                        continue
+                    taken.add(msec)
+                    snapped.append((msec, output_file))
+                timestamps = snapped
+
+            if timestamps:
+                plans.append((file, sorted(timestamps)))
+
+        self._extract(plans)
+        files = [output_file for _, timestamps in plans for _, output_file in timestamps if output_file.exists()]
+        return files, self.frames
+
+    def refine(self, offsets: dict[Path, list[int]]) -> tuple[list[Path], list[RawFrame]]:
+        # Extracts screenshots at the given offsets (in milliseconds) from the timestamps of the
+        # given screenshots, within the considered duration (see ScreenshotProcessor._refine_best).
+        # Timestamps at which a screenshot was already taken are skipped.
+        keyframes_only = Config.screenshots_keyframe_seek or Config.screenshots_candidates == "packet_size"
+
+        plans: list[tuple[FileMetadata, list[tuple[int, Path]]]] = []
+        for file in self._files():
+            duration = int(file.duration / 2 if Config.screenshots_no_spoilers else file.duration)
+            taken = {msec for source, msec in self.timestamps.values() if source is file}
+
+            msecs: set[int] = set()
+            for path, path_offsets in offsets.items():
+                source, msec = self.timestamps[path]
+                if source is not file:
+                    continue
+                msecs.update(min(max(0, msec + offset), max(0, duration - 1)) for offset in path_offsets)
+
+            timestamps: list[tuple[int, Path]] = []
+            for msec in sorted(msecs - taken):
+                self._n_refined += 1
+                timestamps.append((msec, self._output_file(file, msec, f"refine_{self._n_refined:03}.png")))
+
+            if timestamps and keyframes_only:
+                # Only keyframes get decoded, hence neighbouring timestamps may end up at the same one
+                snapped: list[tuple[int, Path]] = []
+                for msec, output_file in self._snap_to_keyframes(file, timestamps, duration):
+                    if msec in taken:
+                        del self.timestamps[output_file]
+                        continue
+                    taken.add(msec)
+                    snapped.append((msec, output_file))
+                timestamps = snapped
+
+            if timestamps:
+                plans.append((file, sorted(timestamps)))
+
+        self._extract(plans)
+        files = [output_file for _, timestamps in plans for _, output_file in timestamps if output_file.exists()]
+        return files, self.frames
+
+    def generate_coarse(self) -> None:
+        # First pass of the two-pass search: many downscaled screenshots
+        self.screenshots_dir.mkdir(exist_ok=True)
+        self._extract(
+            self._plan(Config.screenshots_n_coarse, prefix="coarse"),
+            height=Config.screenshots_coarse_height
+        )
+
+    def generate_at(
+        self, timestamps: list[tuple[FileMetadata, int]], on_extracted: Optional[ExtractedCallback] = None
+    ) -> None:
+        # Second pass of the two-pass search: full resolution screenshots at the given timestamps
+        self.screenshots_dir.mkdir(exist_ok=True)
+
+        plans: list[tuple[FileMetadata, list[tuple[int, Path]]]] = []
+        i = 0
+        for file in self._files():
+            msecs = sorted(msec for f, msec in timestamps if f is file)
+            if not msecs:
+                continue
+
+            print(f'generating screenshots for "{file.path.name}"')
+
+            file_timestamps: list[tuple[int, Path]] = []
+            for msec in msecs:
+                i += 1
+                print(f" --> {i}/{len(timestamps)} ({ms_to_hhmmss(msec)})")
+                file_timestamps.append((msec, self._output_file(file, msec, f"pre_{i:03}.png")))
+
+            plans.append((file, file_timestamps))
+
+        self._extract(plans, on_extracted=on_extracted)
+
+    def _files(self) -> list[FileMetadata]:
+        if self.is_single_file:
+            return [self.file_metadata]
+        return self.dir_metadata.file_metadata
+
+    def _output_file(self, file: FileMetadata, msec: int, name: str) -> Path:
+        output_file = self.screenshots_dir / name
+        self.created_image_files.append(output_file)
+        self.timestamps[output_file] = (file, msec)
+        return output_file
+
+    def _plan(
+        self, n_screenshots: int, prefix: str
+    ) -> list[tuple[FileMetadata, list[tuple[int, Path]]]]:
+        plans: list[tuple[FileMetadata, list[tuple[int, Path]]]] = []
+
+        if self.is_single_file:
+            plans.append((
+                self.file_metadata,
+                self._plan_screenshots(
+                    file=self.file_metadata,
+                    it_from=0,
+                    it_to=n_screenshots,
+                    n_screenshots=n_screenshots,
+                    prefix=prefix
+                )
+            ))
         else:
             # Partition indices into 3 parts
             n_parts = len(self.dir_metadata.file_metadata)
@@ -73,11 +285,18 @@ class ScreenshotTaker:
 
             # Iterate over available files
             for i, file_metadata in enumerate(self.dir_metadata.file_metadata):
-                self._generate_screenshots(
-                    file=file_metadata,
-                    it_from=0 if i == 0 else k * i + r,
-                    it_to=k * (i + 1) + r
-                )
+                plans.append((
+                    file_metadata,
+                    self._plan_screenshots(
+                        file=file_metadata,
+                        it_from=0 if i == 0 else k * i + r,
+                        it_to=k * (i + 1) + r,
+                        n_screenshots=n_screenshots,
+                        prefix=prefix
+                    )
+                ))
+
+        return plans
 
     def cleanup(self) -> None:
         # Delete temporary files
@@ -94,10 +313,12 @@ class ScreenshotTaker:
         except OSError as e:
             print(f"failed to remove .screens dir: {e}")
 
-    def _generate_screenshots(self, file: FileMetadata, it_from: int, it_to: int) -> None:
+    def _plan_screenshots(
+        self, file: FileMetadata, it_from: int, it_to: int, n_screenshots: int, prefix: str
+    ) -> list[tuple[int, Path]]:
         if file.duration <= 0:
             print(f'skipping screenshots for "{file.path.name}": video_duration <= 0')
-            return
+            return []
 
         duration = file.duration
         if Config.screenshots_no_spoilers:
@@ -111,32 +332,381 @@ class ScreenshotTaker:
 
         # TODO: tonemapping?
         # -vf "zscale=transfer=linear,tonemap=hable,zscale=transfer=bt709"
-        # scene_filter = Config.screenshots_ffmpeg_scene_filter
-        # if scene_filter is not None:
-        #    conditional_args += ["-vf", f"select='gt(scene,{scene_filter})'"]
 
-        for i in range(it_from + 1, it_to + 1):
-            msec = int((i * duration) // (it_to + 1))
-            print(f" --> {i}/{Config.screenshots_n_preprocess} ({ms_to_hhmmss(msec)})")
+        msecs = [int((i * duration) // (it_to + 1)) for i in range(it_from + 1, it_to + 1)]
+        if Config.screenshots_candidates == "scene" and Config.screenshots_ffmpeg_scene_filter is not None:
+            msecs = self._pick_scene_changes(file, msecs, int(duration // (it_to + 1)), int(duration))
+        elif Config.screenshots_candidates == "packet_size":
+            msecs = self._pick_largest_keyframes(file, msecs, int(duration // (it_to + 1)), int(duration))
+
+        timestamps: list[tuple[int, Path]] = []
+        for i, msec in zip(range(it_from + 1, it_to + 1), msecs):
+            print(f" --> {i}/{n_screenshots} ({ms_to_hhmmss(msec)})")
+            timestamps.append((msec, self._output_file(file, msec, f"{prefix}_{i:03}.png")))
+
+        if Config.screenshots_keyframe_seek:
+            timestamps = self._snap_to_keyframes(file, timestamps, int(duration))
+
+        return timestamps
 
-            output_file = self.screenshots_dir / f"pre_{i:03}.png"
-            self.created_image_files.append(output_file)
+    def _pick_scene_changes(
+        self, file: FileMetadata, msecs: list[int], interval: int, duration: int
+    ) -> list[int]:
+        # Move every interval timestamp to the closest (not yet picked) scene change,
+        # as long as it's less than half an interval away. This keeps the
+        # screenshots spread over the whole considered duration.
+        cpu_start = children_cpu_seconds()
+        t_start = time.perf_counter()
+        try:
+            scenes = self._detect_scenes(file, duration)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f" --> scene detection failed, using fixed intervals: {e}")
+            return msecs
+
+        cpu_elapsed = children_cpu_seconds() - cpu_start
+        self.cpu_seconds += cpu_elapsed
+        print(
+            f" --> detected {len(scenes)} scene changes in {time.perf_counter() - t_start:.2f}s "
+            f"({cpu_elapsed:.2f} CPU-seconds)"
+        )
+
+        picked: list[int] = []
+        available = set(scenes)
+        n_moved = 0
+        for msec in msecs:
+            nearest = min(available, key=lambda x: abs(x - msec), default=None)
+            if nearest is None or abs(nearest - msec) > interval // 2:
+                picked.append(msec)
+                continue
+
+            available.discard(nearest)
+            picked.append(nearest)
+            n_moved += 1
+
+        print(f" --> {n_moved}/{len(msecs)} timestamps were moved to a scene change")
+        return picked
+
+    def _pick_largest_keyframes(
+        self, file: FileMetadata, msecs: list[int], interval: int, duration: int
+    ) -> list[int]:
+        # The compressed size of a keyframe tells where the encoder spent its bits,
+        # i.e. where the detailed frames are - without decoding anything.
+        if not msecs:
+            # e.g. fewer screenshots than files in a directory
+            return msecs
+
+        lower = max(0, msecs[0] - interval // 2)
+        upper = min(duration, msecs[-1] + interval // 2)
+
+        cpu_start = children_cpu_seconds()
+        t_start = time.perf_counter()
+        try:
+            index = KeyframeIndex(file.path, intervals=[(lower, upper)])
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f" --> failed to probe keyframes, using fixed intervals: {e}")
+            return msecs
+
+        cpu_elapsed = children_cpu_seconds() - cpu_start
+        self.cpu_seconds += cpu_elapsed
+
+        keyframes = [k for k in index.keyframes if lower <= k.msec <= upper]
+        print(
+            f" --> read {len(keyframes)} keyframe packets in {time.perf_counter() - t_start:.2f}s "
+            f"({cpu_elapsed:.2f} CPU-seconds)"
+        )
+        if len(keyframes) < len(msecs):
+            print(" --> not enough keyframes, using fixed intervals")
+            return msecs
+
+        # Sort according to size, so we remove top-n outliers first
+        # (e.g. flashes or noise, the same way as the screenshot file sizes are pruned)
+        keyframes = sorted(keyframes, key=lambda x: -x.size)
+        if len(keyframes) > 1:
+            sizes = [k.size for k in keyframes]
+            upper_size = statistics.mean(sizes) + statistics.stdev(sizes) * 1.25
+
+            n_removals = 0
+            while (
+                n_removals < Config.screenshots_n_outlier_prunes
+                and keyframes[n_removals].size > upper_size
+                and len(keyframes) - n_removals > len(msecs)
+            ):
+                n_removals += 1
+
+            if n_removals > 0:
+                print(f" --> removed {n_removals} upper bound outlier keyframe(s)")
+            keyframes = keyframes[n_removals:]
+
+        # Pick the largest keyframes which are at least half an interval apart
+        # (if possible), so that the screenshots don't all come from one scene
+        picked: list[int] = []
+        for min_gap in (interval // 2, 0):
+            for keyframe in keyframes:
+                if len(picked) == len(msecs):
+                    break
 
+                if all(abs(keyframe.msec - msec) > min_gap for msec in picked):
+                    picked.append(keyframe.msec)
+
+        picked = sorted(picked)
+        sizes = {k.msec: k.size for k in keyframes}
+        print(
+            f" --> picked keyframes of {min(sizes[msec] for msec in picked) / 1024:.0f}-"
+            f"{max(sizes[msec] for msec in picked) / 1024:.0f} KiB (out of "
+            f"{keyframes[-1].size / 1024:.0f}-{keyframes[0].size / 1024:.0f} KiB)"
+        )
+        return picked
+
+    @staticmethod
+    def _detect_scenes(file: FileMetadata, duration: int) -> list[int]:
+        # A single streaming pass which only decodes keyframes (encoders tend to
+        # place them at scene changes anyway) at a low resolution.
+        output = subprocess.run(
+            executable="ffmpeg",
+            args=[
+                "ffmpeg",
+                # throw an error if something goes wrong
+                "-loglevel", "error",
+                # only I-frames
+                "-skip_frame", "nokey",
+                # only read the considered duration
+                "-t", f"{duration}ms",
+                # specify input file
+                "-i", str(file.path),
+                # video only
+                "-an", "-sn", "-dn",
+                # print the timestamps of frames whose scene score exceeds the threshold
+                "-vf",
+                f"scale=-2:{SCENE_DETECTION_HEIGHT},"
+                f"select='gt(scene,{Config.screenshots_ffmpeg_scene_filter})',"
+                "metadata=print:file=-",
+                # don't drop or duplicate frames to match a frame rate
+                # (-vsync instead of -fps_mode, which needs ffmpeg 5.1+)
+                "-vsync", "passthrough",
+                # discard the output
+                "-f", "null", "-",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+        return [
+            int(float(m.group(1)) * 1000)
+            for m in re.finditer(r"pts_time:\s*([0-9.]+)", output)
+        ]
+
+    def _snap_to_keyframes(
+        self,
+        file: FileMetadata, timestamps: list[tuple[int, Path]], duration: int
+    ) -> list[tuple[int, Path]]:
+        # Only read the packets surrounding every timestamp
+        window = int(Config.screenshots_keyframe_search_window * 1000)
+        try:
+            index = KeyframeIndex(
+                file.path, intervals=[(msec - window, msec + window) for msec, _ in timestamps]
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f" --> failed to probe keyframes, using exact timestamps: {e}")
+            return timestamps
+
+        print(f" --> snapping timestamps to the nearest of {len(index)} probed keyframes")
+
+        snapped: list[tuple[int, Path]] = []
+        shifts: list[int] = []
+        for msec, output_file in timestamps:
+            keyframe = index.nearest(msec, lower=0, upper=duration)
+            if keyframe is None:
+                print(f"{' ':5}{output_file.stem}: no keyframe within {window / 1000:.1f}s, keeping {ms_to_hhmmss(msec)}")
+                snapped.append((msec, output_file))
+                continue
+
+            shift = keyframe.msec - msec
+            print(f"{' ':5}{output_file.stem}: {ms_to_hhmmss(msec)} -> {ms_to_hhmmss(keyframe.msec)} ({shift / 1000:+.3f}s)")
+            snapped.append((keyframe.msec, output_file))
+            self.timestamps[output_file] = (file, keyframe.msec)
+            shifts.append(abs(shift))
+
+        if shifts:
+            print(
+                f" --> moved {len(shifts)} timestamps by {sum(shifts) / len(shifts) / 1000:.3f}s "
+                f"on average (max. {max(shifts) / 1000:.3f}s)"
+            )
+
+        return snapped
+
+    def _extract(
+        self,
+        plans: list[tuple[FileMetadata, list[tuple[int, Path]]]],
+        height: Optional[int] = None,
+        on_extracted: Optional[ExtractedCallback] = None,
+    ) -> None:
+        # on_extracted gets called (from this thread) with the screenshot files
+        # or raw frames of every ffmpeg job as soon as the job has finished
+        self.frames = []
+
+        n_workers = max(1, Config.screenshots_ffmpeg_workers)
+        if Config.screenshots_ffmpeg_single_process:
+            mode = "single-process"
+        else:
+            mode = "per-frame"
+
+        # Split every file's timestamps into jobs. A per-frame job is a single
+        # timestamp, whereas single-process jobs get spread over the workers
+        # which aren't occupied by other files.
+        n_files = max(1, sum(1 for _, timestamps in plans if timestamps))
+        jobs: list[tuple[FileMetadata, list[tuple[int, Path]]]] = []
+        for file, timestamps in plans:
+            if not timestamps:
+                continue
+
+            if Config.screenshots_ffmpeg_single_process:
+                n_chunks = min(len(timestamps), math.ceil(n_workers / n_files))
+            else:
+                n_chunks = len(timestamps)
+
+            k, r = divmod(len(timestamps), n_chunks)
+            start = 0
+            for n in range(n_chunks):
+                end = start + k + (1 if n < r else 0)
+                jobs.append((file, timestamps[start:end]))
+                start = end
+
+        if not jobs:
+            return
+
+        if Config.screenshots_ffmpeg_raw_frames:
+            mode += " raw"
+            for file, _ in plans:
+                if file.width <= 0 or file.height <= 0:
+                    print(f' --> unknown resolution of "{file.path.name}", extracting PNG files instead')
+
+        if height is not None:
+            mode += f", {height}p"
+
+        print(f"extracting screenshots using {min(n_workers, len(jobs))} ffmpeg worker(s) ({mode} mode)")
+
+        # Wall time boundaries (start, end) of each file's extraction
+        timings: dict[Path, list[float]] = {}
+
+        # Filled in by the extraction jobs
+        stats = self.ffmpeg_stats if Config.screenshots_ffmpeg_stats is not None else None
+
+        def run(file: FileMetadata, timestamps: list[tuple[int, Path]]) -> tuple[list[Path], list[RawFrame]]:
+            paths, frames = [], []
+
+            t_job_start = time.perf_counter()
+            if Config.screenshots_ffmpeg_raw_frames and file.width > 0 and file.height > 0:
+                frames = self._extract_raw(file, timestamps, height, stats)
+                self.frames += frames
+            elif Config.screenshots_ffmpeg_single_process:
+                self._extract_single_process(file, timestamps, height, stats)
+                paths = [output_file for _, output_file in timestamps]
+            else:
+                self._extract_per_frame(file, timestamps, height, stats)
+                paths = [output_file for _, output_file in timestamps]
+            t_job_end = time.perf_counter()
+
+            timing = timings.setdefault(file.path, [t_job_start, t_job_end])
+            timing[0] = min(timing[0], t_job_start)
+            timing[1] = max(timing[1], t_job_end)
+
+            return paths, frames
+
+        cpu_start = children_cpu_seconds()
+        t_start = time.perf_counter()
+        # ffmpeg does the heavy lifting in its own process, threads just wait on it
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(run, file, timestamps) for file, timestamps in jobs]
+            for future in as_completed(futures):
+                paths, frames = future.result()
+                if on_extracted is not None:
+                    on_extracted(paths, frames)
+
+        for file, timestamps in plans:
+            if file.path not in timings:
+                continue
+
+            t_file_start, t_file_end = timings[file.path]
+            print(
+                f' --> extracted {len(timestamps)} frames from "{file.path.name}" '
+                f"in {t_file_end - t_file_start:.2f}s"
+            )
+
+        cpu_elapsed = children_cpu_seconds() - cpu_start
+        self.cpu_seconds += cpu_elapsed
+        print(f" --> extraction finished in {time.perf_counter() - t_start:.2f}s ({cpu_elapsed:.2f} CPU-seconds)")
+
+        # Keep the same ordering as the screenshot files would have
+        self.frames = sorted(self.frames, key=lambda x: x.path.name)
+
+    @staticmethod
+    def _input_args(file: FileMetadata, msec: int) -> list[str]:
+        args = [
+            # take a screenshot starting at this timestamp
+            "-ss", f"{msec}ms",
+        ]
+        if Config.screenshots_keyframe_seek or Config.screenshots_candidates == "packet_size":
+            # only I-frames (the timestamp was snapped to one beforehand)
+            args += ["-skip_frame", "nokey"]
+
+        # specify input file
+        return args + ["-i", str(file.path)]
+
+    @staticmethod
+    def _scale_filter(height: Optional[int]) -> Optional[str]:
+        if height is None:
+            return None
+
+        # downscale while preserving aspect ratio (and keeping the width even)
+        return f"scale=-2:{height}"
+
+    @staticmethod
+    def _stats_file(output_file: Path) -> Path:
+        return output_file.with_suffix(".stats")
+
+    @staticmethod
+    def _filter_args(scale: Optional[str], stats_file: Optional[Path]) -> list[str]:
+        # The scale filter (if any), plus computing the frame's statistics (see ffmpeg_stats.py)
+        chain = [scale] if scale is not None else []
+        stats_graph = stats_filter(stats_file) if stats_file is not None else None
+        if stats_graph is not None:
+            chain.append(stats_graph)
+        return ["-vf", ",".join(chain)] if chain else []
+
+    @staticmethod
+    def _read_stats(
+        stats: Optional[dict[Path, FrameStats]], stats_file: Path, output_files: list[Path]
+    ) -> None:
+        # The frames' statistics are in the same order as the frames
+        if stats is None:
+            return
+
+        for output_file, frame_stats in zip(output_files, read_stats(stats_file)):
+            stats[output_file] = frame_stats
+
+    @staticmethod
+    def _extract_per_frame(
+        file: FileMetadata,
+        timestamps: list[tuple[int, Path]],
+        height: Optional[int] = None,
+        stats: Optional[dict[Path, FrameStats]] = None,
+    ) -> None:
+        for msec, output_file in timestamps:
+            stats_file = ScreenshotTaker._stats_file(output_file) if stats is not None else None
             _output = subprocess.run(
                 executable="ffmpeg",
                 args=[
+                    "ffmpeg",
                     # overwrite files without asking
                     "-y",
                     # throw an error if something goes wrong
                     "-loglevel", "level+error",
-                    # take a screenshot starting at this timestamp
-                    "-ss", f"{msec}ms",
-                    # specify input file
-                    "-i", str(file.path),
-                    # only I-frames
-                    #"-skip_frame", "nokey",
+                    # seek to the timestamp and specify input file
+                    *ScreenshotTaker._input_args(file, msec),
                     # add conditional args
                     # *conditional_args,
+                    *ScreenshotTaker._filter_args(ScreenshotTaker._scale_filter(height), stats_file),
                     # take a screenshot over 1 frame
                     "-frames:v", "1",
                     # transparent quality, i.e. don't re-encode
@@ -148,3 +718,143 @@ class ScreenshotTaker:
                 ],
                 check=True,
             )
+            if stats_file is not None:
+                ScreenshotTaker._read_stats(stats, stats_file, [output_file])
+
+    @staticmethod
+    def _extract_single_process(
+        file: FileMetadata,
+        timestamps: list[tuple[int, Path]],
+        height: Optional[int] = None,
+        stats: Optional[dict[Path, FrameStats]] = None,
+    ) -> None:
+        # The ffmpeg CLI can't seek a single input to several positions,
+        # so every seek point becomes its own (input-seeked) input of one
+        # ffmpeg process. This way we pay for process startup, library
+        # initialization and codec setup only once per file.
+        input_args: list[str] = []
+        output_args: list[str] = []
+        for n, (msec, output_file) in enumerate(timestamps):
+            stats_file = ScreenshotTaker._stats_file(output_file) if stats is not None else None
+            input_args += ScreenshotTaker._input_args(file, msec)
+            output_args += [
+                # first video stream of the n-th input (ignoring cover art)
+                "-map", f"{n}:V:0",
+                *ScreenshotTaker._filter_args(ScreenshotTaker._scale_filter(height), stats_file),
+                # take a screenshot over 1 frame
+                "-frames:v", "1",
+                # transparent quality, i.e. don't re-encode
+                "-q:v", "10",
+                # output as png
+                "-c:v", "png",
+                # specify output file
+                str(output_file),
+            ]
+
+        _output = subprocess.run(
+            executable="ffmpeg",
+            args=[
+                "ffmpeg",
+                # overwrite files without asking
+                "-y",
+                # throw an error if something goes wrong
+                "-loglevel", "level+error",
+                *input_args,
+                *output_args,
+            ],
+            check=True,
+        )
+        for _, output_file in timestamps:
+            ScreenshotTaker._read_stats(stats, ScreenshotTaker._stats_file(output_file), [output_file])
+
+    @staticmethod
+    def _extract_raw(
+        file: FileMetadata,
+        timestamps: list[tuple[int, Path]],
+        height: Optional[int] = None,
+        stats: Optional[dict[Path, FrameStats]] = None,
+    ) -> list[RawFrame]:
+        import numpy
+
+        # Frames are piped as packed RGB, so their size must be known beforehand
+        if height is None:
+            width, height = file.width, file.height
+        else:
+            width = 2 * round(file.width * height / file.height / 2)
+        frame_size = width * height * 3
+        scale = f"scale={width}:{height}"
+
+        if Config.screenshots_ffmpeg_single_process:
+            input_args: list[str] = []
+            for msec, _ in timestamps:
+                input_args += ScreenshotTaker._input_args(file, msec)
+
+            # Concatenate the first frame of every input into a single stream
+            chains = [
+                f"[{n}:V:0]trim=end_frame=1,setpts=PTS-STARTPTS,{scale}[v{n}]"
+                for n in range(len(timestamps))
+            ]
+            concat = "".join(f"[v{n}]" for n in range(len(timestamps)))
+            graph = ";".join(chains) + f";{concat}concat=n={len(timestamps)}:v=1:a=0"
+            # Statistics of all frames end up in a single file
+            stats_file = ScreenshotTaker._stats_file(timestamps[0][1]) if stats is not None else None
+            stats_graph = stats_filter(stats_file, output="out") if stats_file is not None else None
+            graph += f",{stats_graph}" if stats_graph is not None else "[out]"
+            commands = [(
+                input_args,
+                stats_file,
+                [output_file for _, output_file in timestamps],
+                [
+                    "-filter_complex", graph,
+                    "-map", "[out]",
+                    # don't drop or duplicate frames to match a frame rate
+                    # (-vsync instead of -fps_mode, which needs ffmpeg 5.1+)
+                    "-vsync", "passthrough",
+                ],
+                len(timestamps),
+            )]
+        else:
+            commands = []
+            for msec, output_file in timestamps:
+                stats_file = ScreenshotTaker._stats_file(output_file) if stats is not None else None
+                commands.append((
+                    ScreenshotTaker._input_args(file, msec),
+                    stats_file,
+                    [output_file],
+                    [*ScreenshotTaker._filter_args(scale, stats_file), "-frames:v", "1"],
+                    1,
+                ))
+
+        chunks: list[bytes] = []
+        for input_args, stats_file, output_files, filter_args, n_frames in commands:
+            output = subprocess.run(
+                executable="ffmpeg",
+                args=[
+                    "ffmpeg",
+                    # throw an error if something goes wrong
+                    "-loglevel", "level+error",
+                    *input_args,
+                    *filter_args,
+                    # decoded frames as packed RGB
+                    "-f", "rawvideo",
+                    "-pix_fmt", "rgb24",
+                    # write frames to stdout instead of the .screens dir
+                    "pipe:1",
+                ],
+                check=True,
+                capture_output=True,
+            ).stdout
+            if len(output) != n_frames * frame_size:
+                raise RuntimeError(
+                    f"ffmpeg returned {len(output)} bytes, expected {n_frames} {width}x{height} frames"
+                )
+
+            chunks.append(output)
+            if stats_file is not None:
+                ScreenshotTaker._read_stats(stats, stats_file, output_files)
+
+        frames = numpy.frombuffer(b"".join(chunks), dtype=numpy.uint8).reshape((len(timestamps), height, width, 3))
+        return [
+            RawFrame(path=output_file, msec=msec, frame=frames[n])
+            for n, (msec, output_file) in enumerate(timestamps)
+        ]
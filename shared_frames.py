@@ -0,0 +1,86 @@
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy
+
+
+@dataclass
+class SharedFrame:
+    # Handle of a decoded RGB frame in a shared memory block, which
+    # (unlike the frame itself) is cheap to send to another process
+    name: str
+    shape: tuple[int, ...]
+
+    @contextmanager
+    def attach(self) -> Iterator["numpy.ndarray"]:
+        # Maps the frame as a (read-only) array, without copying it.
+        # The array mustn't be used after leaving the context.
+        import numpy
+
+        block = shared_memory.SharedMemory(name=self.name)
+        frame = numpy.ndarray(self.shape, dtype=numpy.uint8, buffer=block.buf)
+        frame.flags.writeable = False
+        try:
+            yield frame
+        finally:
+            del frame
+            _close(block)
+
+
+def _close(block: shared_memory.SharedMemory) -> None:
+    try:
+        block.close()
+    except BufferError:
+        # Arrays still point into the block. It stays mapped until they're gone.
+        pass
+
+
+class SharedFrameStore:
+    # Owns the shared memory blocks of the frames handed to the scoring processes.
+    # Only the scoring processes map them. Blocks are unlinked by release
+    # (and, should this process be killed, by multiprocessing's resource tracker).
+    def __init__(self):
+        self._blocks: dict[str, shared_memory.SharedMemory] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.size for block in self._blocks.values())
+
+    def put(self, frame: "numpy.ndarray") -> SharedFrame:
+        # Copies the frame into a new block
+        import numpy
+
+        block = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+        with self._lock:
+            self._blocks[block.name] = block
+
+        shared = numpy.ndarray(frame.shape, dtype=numpy.uint8, buffer=block.buf)
+        shared[...] = frame
+        del shared
+        return SharedFrame(block.name, frame.shape)
+
+    def decode(self, path: Path) -> SharedFrame:
+        # Decodes the image (the same way ScoringContext does) into a new block
+        from scoring_context import decode_image
+
+        return self.put(decode_image(path))
+
+    def release(self) -> None:
+        with self._lock:
+            blocks, self._blocks = self._blocks, {}
+
+        for block in blocks.values():
+            _close(block)
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
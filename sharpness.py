@@ -20,10 +20,19 @@ import cv2
 
 class DOM(object):
 
-    def __init__(self):
+    def __init__(self, compact=False, strip_height=None):
+        """
+        :param compact: compute the sharpness with fewer (reused) buffers
+        :type: boolean
+
+        :param strip_height: (compact only) process the image in strips of this many rows
+        :type: int or None
+        """
         self.image = None
         self.Im = None
         self.edgex, self.edgey = None, None
+        self.compact = compact
+        self.strip_height = strip_height
 
     @staticmethod
     def load(img, blur=False, blurSize=(5, 5)):
@@ -122,21 +131,21 @@ class DOM(object):
         :return image_smoothed: smoothened image
         :type: np.ndarray
         """
-        fil = np.array([0.5, 0, -0.5])  # Smoothing Filter
+        # Smoothing Filter ([0.5, 0, -0.5] convolution, i.e. flipped for correlation)
+        fil = np.array([[-0.5, 0, 0.5]])
 
-        # change image axis for column convolution
+        # apply filter on the vertical axis instead of transposing the image
         if transpose:
-            image = image.T
+            fil = fil.T
 
-        # Convolve grayscale image with smoothing filter
-        image_smoothed = np.array([np.convolve(image[i], fil, mode="same") for i in range(image.shape[0])])
-
-        # change image axis after column convolution
-        if transpose:
-            image_smoothed = image_smoothed.T
+        # Correlate the whole grayscale image with the smoothing filter at once
+        # (zero padding, same as np.convolve(..., mode="same") for each row)
+        image_smoothed = cv2.filter2D(image, cv2.CV_64F, fil, borderType=cv2.BORDER_CONSTANT)
 
         # Normalize smoothened grayscale image
-        image_smoothed = np.abs(image_smoothed) / (np.max(image_smoothed) + epsilon)
+        max_value = np.max(image_smoothed)
+        np.abs(image_smoothed, out=image_smoothed)
+        image_smoothed /= max_value + epsilon
         return image_smoothed
 
     def edges(self, image, edge_threshold=0.0001):
@@ -158,6 +167,33 @@ class DOM(object):
         self.edgex = smoothx > edge_threshold
         self.edgey = smoothy > edge_threshold
 
+    @staticmethod
+    def window_sum(matrix, width, axis):
+        """ Sum over a sliding window of 2*width elements along an axis
+        :param matrix: input matrix
+        :type: np.ndarray
+
+        :param width: edge width
+        :type: int
+
+        :param axis: axis along which the window slides
+        :type: int
+
+        :return sums: window sums for the positions width..n-width-1 along the axis
+        :type: np.ndarray
+        """
+        n = matrix.shape[axis] - 2 * width
+        sums = np.zeros(matrix.shape[:axis] + (max(0, n),) + matrix.shape[axis + 1:], dtype=matrix.dtype)
+        if n <= 0:
+            return sums
+
+        # Add the shifted windows in order (same result as summing each window)
+        index = [slice(None)] * matrix.ndim
+        for offset in range(2 * width):
+            index[axis] = slice(offset, offset + n)
+            sums += matrix[tuple(index)]
+        return sums
+
     def sharpness_matrix(self, Im, width=2, debug=False):
         """ Find sharpness value at each pixel
         :param Im: median filtered grayscale image
@@ -190,16 +226,14 @@ class DOM(object):
         Sy = np.zeros(domy.shape)
 
         # Compute Sx
-        for i in range(width, domx.shape[0] - width):
-            num = np.abs(domx[i - width:i + width, :]).sum(axis=0)
-            dn = Cx[i - width:i + width, :].sum(axis=0)
-            Sx[i] = [(num[k] / dn[k] if dn[k] > 1e-3 else 0) for k in range(Sx.shape[1])]
+        num = self.window_sum(np.abs(domx), width, axis=0)
+        dn = self.window_sum(Cx, width, axis=0)
+        np.divide(num, dn, out=Sx[width:domx.shape[0] - width, :], where=dn > 1e-3)
 
         # Compute Sy
-        for j in range(width, domy.shape[1] - width):
-            num = np.abs(domy[:, j - width: j + width]).sum(axis=1)
-            dn = Cy[:, j - width:j + width].sum(axis=1)
-            Sy[:, j] = [(num[k] / dn[k] if dn[k] > 1e-3 else 0) for k in range(Sy.shape[0])]
+        num = self.window_sum(np.abs(domy), width, axis=1)
+        dn = self.window_sum(Cy, width, axis=1)
+        np.divide(num, dn, out=Sy[:, width:domy.shape[1] - width], where=dn > 1e-3)
 
         if debug:
             print(f"domx {domx.shape}: {[(i, round(np.quantile(domx, i / 100), 2)) for i in range(0, 101, 25)]}")
@@ -250,6 +284,126 @@ class DOM(object):
             print(f"Sharpx: {n_sharpx}, Sharpy: {n_sharpy}, Edges: {n_edgex, n_edgey}")
         return S
 
+    @staticmethod
+    def compact_counts(image, Im, rows, width, sharpness_threshold, edge_threshold, max_x, max_y, epsilon=1e-8):
+        """ Sharp and edge pixel counts of a strip, reusing buffers in place
+        :param image: grayscale image strip (including halo rows)
+        :type: np.ndarray
+
+        :param Im: median filtered grayscale image strip (uint8, including halo rows)
+        :type: np.ndarray
+
+        :param rows: rows of the strip to count (excluding halo rows)
+        :type: slice
+
+        :param max_x, max_y: maxima of the smoothened (whole) image on both axes
+        :type: float
+
+        :return counts: n_sharpx, n_sharpy, n_edgex, n_edgey
+        :type: tuple
+        """
+        # NOTE: The operations are carried out in the same order and precision as in
+        # get_sharpness. Many pixels lie exactly at the sharpness threshold, hence
+        # any other rounding (e.g. float32) noticeably changes the result.
+
+        # Edges (see smoothenImage and edges)
+        fil = np.array([[-0.5, 0, 0.5]])
+        edgex = cv2.filter2D(image, cv2.CV_64F, fil.T, borderType=cv2.BORDER_CONSTANT)
+        np.abs(edgex, out=edgex)
+        edgex /= max_x + epsilon
+        edgex = edgex > edge_threshold
+        edgey = cv2.filter2D(image, cv2.CV_64F, fil, borderType=cv2.BORDER_CONSTANT)
+        np.abs(edgey, out=edgey)
+        edgey /= max_y + epsilon
+        edgey = edgey > edge_threshold
+
+        Im = Im.astype("double")
+        Im /= 255.0
+        d = np.empty_like(Im)
+        buffer = np.empty_like(Im)
+
+        counts = []
+        for axis, edge in ((0, edgex), (1, edgey)):
+            lo = [slice(None)] * 2
+            hi = [slice(None)] * 2
+            end = [slice(None)] * 2
+            lo[axis], hi[axis], end[axis] = slice(None, -2), slice(2, None), slice(-2, None)
+
+            # DOM (see dom): |Im[i + 2] - 2 * Im[i] + Im[i - 2]|
+            d[tuple(lo)] = Im[tuple(hi)]
+            d[tuple(end)] = 0
+            np.multiply(Im, 2, out=buffer)
+            d -= buffer
+            d[tuple(hi)] += Im[tuple(lo)]
+            np.abs(d, out=d)
+            num = DOM.window_sum(d, width, axis=axis)
+
+            # Contrast of edge pixels (see contrast): |Im[i] - Im[i - 1]|
+            lo[axis], hi[axis], end[axis] = slice(None, -1), slice(1, None), slice(None, 1)
+            c = buffer
+            np.subtract(Im[tuple(hi)], Im[tuple(lo)], out=c[tuple(hi)])
+            c[tuple(end)] = Im[tuple(end)]
+            np.abs(c, out=c)
+            c *= edge
+            dn = DOM.window_sum(c, width, axis=axis)
+
+            # Sharpness (see sharpness_matrix), reusing the DOM buffer
+            S = d
+            S.fill(0)
+            inner = [slice(None)] * 2
+            inner[axis] = slice(width, Im.shape[axis] - width)
+            np.divide(num, dn, out=S[tuple(inner)], where=dn > 1e-3)
+            del num, dn
+
+            counts.append(np.count_nonzero((S[rows] >= sharpness_threshold) & edge[rows]))
+
+        return counts[0], counts[1], np.count_nonzero(edgex[rows]), np.count_nonzero(edgey[rows])
+
+    def get_sharpness_compact(self, img, width=2, sharpness_threshold=2, edge_threshold=0.0001, epsilon=1e-8):
+        """ Same as get_sharpness, but with bounded memory usage
+        :param img: grayscale image matrix
+        :type: np.ndarray
+
+        :return score: image sharpness measure(0<S<sqrt(2))
+        :type: float
+        """
+        image, _ = self.load(img) if img.ndim == 3 else (img, None)
+        Im = cv2.medianBlur(image, 3)
+
+        n_rows = image.shape[0]
+        strip_height = self.strip_height or n_rows
+        # Every pixel depends on at most width + 2 rows above/below it
+        halo = width + 2
+
+        # The edge thresholds are relative to the maxima over the whole image
+        # (the smoothened values are multiples of 0.5, hence float32 is exact)
+        fil = np.array([[-0.5, 0, 0.5]], dtype=np.float32)
+        max_x, max_y = -np.inf, -np.inf
+        for start in range(0, n_rows, strip_height):
+            end = min(n_rows, start + strip_height)
+            a, b = max(0, start - 1), min(n_rows, end + 1)
+            rows = slice(start - a, end - a)
+            strip = image[a:b]
+            max_x = max(max_x, float(cv2.filter2D(strip, cv2.CV_32F, fil.T, borderType=cv2.BORDER_CONSTANT)[rows].max()))
+            max_y = max(max_y, float(cv2.filter2D(strip, cv2.CV_32F, fil, borderType=cv2.BORDER_CONSTANT)[rows].max()))
+
+        n_sharpx, n_sharpy, n_edgex, n_edgey = 0, 0, 0, 0
+        for start in range(0, n_rows, strip_height):
+            end = min(n_rows, start + strip_height)
+            a, b = max(0, start - halo), min(n_rows, end + halo)
+            counts = self.compact_counts(
+                image[a:b], Im[a:b], slice(start - a, end - a), width,
+                sharpness_threshold, edge_threshold, max_x, max_y, epsilon=epsilon
+            )
+            n_sharpx += counts[0]
+            n_sharpy += counts[1]
+            n_edgex += counts[2]
+            n_edgey += counts[3]
+
+        Rx = n_sharpx / (n_edgex + epsilon)
+        Ry = n_sharpy / (n_edgey + epsilon)
+        return np.sqrt(Rx ** 2 + Ry ** 2)
+
     def get_sharpness(self, img, width=2, sharpness_threshold=2, edge_threshold=0.0001, debug=False):
         """ Image Sharpness Assessment
         :param img: img src or image matrix
@@ -270,6 +424,11 @@ class DOM(object):
         :return score: image sharpness measure(0<S<sqrt(2))
         :type: float
         """
+        if self.compact and isinstance(img, np.ndarray) and not debug:
+            return self.get_sharpness_compact(
+                img, width=width, sharpness_threshold=sharpness_threshold, edge_threshold=edge_threshold
+            )
+
         image, Im = self.load(img)
         # Initialize edge(x|y) matrices
         self.edges(image, edge_threshold=edge_threshold)
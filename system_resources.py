@@ -0,0 +1,91 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path: Path) -> Optional[int]:
+    value = _read(path)
+    if value is None or not value.lstrip("-").isdigit():
+        return None
+    return int(value)
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    # Number of CPUs the cgroup's quota allows (None if there's no limit)
+    cpu_max = _read(CGROUP_ROOT / "cpu.max")
+    if cpu_max is not None:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        quota, _, period = cpu_max.partition(" ")
+        if quota.isdigit() and period.isdigit() and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+
+    # cgroup v1
+    quota = _read_int(CGROUP_ROOT / "cpu" / "cpu.cfs_quota_us")
+    period = _read_int(CGROUP_ROOT / "cpu" / "cpu.cfs_period_us")
+    if quota is not None and period and quota > 0:
+        return quota / period
+    return None
+
+
+def available_cpus() -> float:
+    # CPUs this process may run on, taking affinity and cgroup quotas into account
+    if hasattr(os, "sched_getaffinity"):
+        n_cpus: float = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count() or 1
+
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        n_cpus = min(n_cpus, limit)
+    return n_cpus
+
+
+def cgroup_memory_available_mb() -> Optional[float]:
+    # Memory left until the cgroup's limit is hit (None if there's no limit)
+    limit = _read_int(CGROUP_ROOT / "memory.max")
+    usage = _read_int(CGROUP_ROOT / "memory.current")
+    if limit is None:
+        # cgroup v1 (without a limit, this is a huge number)
+        limit = _read_int(CGROUP_ROOT / "memory" / "memory.limit_in_bytes")
+        usage = _read_int(CGROUP_ROOT / "memory" / "memory.usage_in_bytes")
+
+    if limit is None or usage is None or limit >= 2 ** 60:
+        return None
+    return max(0, limit - usage) / 1024 / 1024
+
+
+def available_memory_mb() -> Optional[float]:
+    # Memory available to new processes, i.e. the smaller of what the system and the cgroup allow
+    available = None
+
+    meminfo = _read(Path("/proc/meminfo"))
+    if meminfo is not None:
+        for line in meminfo.splitlines():
+            if line.startswith("MemAvailable:"):
+                # in kB
+                available = int(line.split()[1]) / 1024
+                break
+
+    cgroup_available = cgroup_memory_available_mb()
+    if cgroup_available is not None:
+        available = cgroup_available if available is None else min(available, cgroup_available)
+    return available
+
+
+def available_shared_memory_mb() -> Optional[float]:
+    # Free space for shared memory blocks (which is often small in containers, e.g. 64MB with Docker)
+    try:
+        stat = os.statvfs("/dev/shm")
+    except (OSError, AttributeError):
+        return None
+    return stat.f_bavail * stat.f_frsize / 1024 / 1024